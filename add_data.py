@@ -2,6 +2,11 @@
 from aider.coders import Coder
 from aider.models import Model
 from aider.io import InputOutput
+from coder_pool import coder_pool
+from schema_index import prompt_notes
+import metrics
+
+AIDER_SECONDS = metrics.histogram('aider_generation_seconds', 'Time Aider takes to edit a script for one prompt')
 
 
 
@@ -9,6 +14,9 @@ class AiderRunner:
     def __init__(self, file_name , user_prompt):
         self.fname = file_name
         self.user_prompt = user_prompt
+        self.notes_file = "excel_notes_2.txt"
+        # Notes handed to the Coder, narrowed to what the prompt touches in run()
+        self.context_file = self.notes_file
         self.coder = None
 
     def setup_coder(self) -> Coder:
@@ -18,7 +26,7 @@ class AiderRunner:
                 main_model=model,
                 io=io,
                 fnames=[self.fname],
-                read_only_fnames=["excel_notes_2.txt"],
+                read_only_fnames=[self.context_file],
                 stream=False,
                 use_git=False,
                 edit_format="diff",
@@ -27,9 +35,15 @@ class AiderRunner:
         return self.coder
 
     def run(self):   
-        coder = self.setup_coder()
         instruction = f"Use the openpyxl library to add to the excel sheet under the last cell with value: {self.user_prompt}"
-        result = coder.run(instruction)
+        # Reuse a warm coder for this file when one is idle, setup_coder only runs for new ones
+        with prompt_notes(self.notes_file, self.user_prompt, self.fname) as context_file:
+            self.context_file = context_file
+            with coder_pool.acquire(self.fname, self.notes_file, self.setup_coder) as coder:
+                coder_pool.use_notes(coder, context_file)
+                self.coder = coder
+                with AIDER_SECONDS.time(script='add_data'):
+                    result = coder.run(instruction)
         return result
     
 
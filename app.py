@@ -1,23 +1,47 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, current_app, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, current_app, send_from_directory, Response, stream_with_context, session, g
 from database_interface import DatabaseInterface
-import subprocess
 import os
+import importlib
 import logging
 from logging.handlers import RotatingFileHandler
 import threading
-from extract_data import AiderRunner
 import time
 import signal
-import queue
 import uuid
+import json
+import atexit
 from werkzeug.utils import secure_filename
+from werkzeug.serving import make_server
 from image_llm import ImageLLM
-from datetime import datetime, timedelta
-from apscheduler.schedulers.background import BackgroundScheduler
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from workbook_cache import WorkbookCache
+from workbook_mirror import WorkbookMirror
+from response_cache import ResponseCache
+from script_registry import ScriptRegistry
+from job_queue import JobQueue
+from script_pool import ScriptWorkerPool, WORKER_SCRIPT
+from process_registry import ProcessRegistry
+from conversation_store import ConversationStore
+from workbook_writer import WorkbookAppendQueue, check_row
+from transcription_cache import TranscriptionCache
+from upload_store import UploadStore
+from file_watcher import FileWatcher, ScriptCatalog, local_imports
+import metrics
+from llm_client import client_from_env
+from worker_state import WorkerState, LeaderLock
+from dotenv import load_dotenv
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'  # Set a secret key for flashing messages
-db = DatabaseInterface()
+load_dotenv()
+# Server-side reads of the spreadsheet go through the workbook cache
+WORKBOOK_FILE = 'studio_database_1.xlsx'
+workbook_cache = WorkbookCache()
+
+# Answers to repeated questions are cached when RESPONSE_CACHE=1, keyed on the workbook version
+response_cache = None
+if os.getenv('RESPONSE_CACHE') == '1':
+    response_cache = ResponseCache(ttl=int(os.getenv('RESPONSE_CACHE_TTL', 3600)))
 
 # Configuration for file uploads
 UPLOAD_FOLDER = 'temp_uploads'
@@ -28,6 +52,76 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max-limit
 # Ensure upload folder exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Derived data (SQLite mirror and other caches) lives in its own folder so the
+# file watcher does not restart the server when these files change
+CACHE_FOLDER = 'cache'
+os.makedirs(CACHE_FOLDER, exist_ok=True)
+
+# With MULTI_WORKER=1 the app runs as several processes under a pre-fork server such as gunicorn.
+# Conversations and job status are shared through SQLite, script runs and jobs stay on the worker that
+# started them and requests for them are forwarded there, scheduled jobs run on one elected worker
+MULTI_WORKER = os.getenv('MULTI_WORKER') == '1'
+worker_state = WorkerState(os.path.join(CACHE_FOLDER, 'workers.sqlite')) if MULTI_WORKER else None
+
+workbook_mirror = WorkbookMirror(WORKBOOK_FILE, os.path.join(CACHE_FOLDER, 'studio_database_1.sqlite'), workbook_cache)
+
+# Row appends are batched into one load-and-save per batch
+append_queue = WorkbookAppendQueue(WORKBOOK_FILE, CACHE_FOLDER)
+
+# Transcriptions keyed by image content, kept on disk across restarts
+transcription_cache = TranscriptionCache(disk_dir=os.path.join(CACHE_FOLDER, 'transcriptions'))
+IMAGE_MAX_DIMENSION = int(os.getenv('IMAGE_MAX_DIMENSION', 1568))
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', 85))
+
+# Batch transcriptions run on a bounded pool
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 4))
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix='image')
+# Transcriptions submitted and not yet finished, reported as the images queue depth
+image_tasks = {'submitted': 0, 'finished': 0}
+image_tasks_lock = threading.Lock()
+
+def image_task_done(future):
+    with image_tasks_lock:
+        image_tasks['finished'] += 1
+
+def submit_image_task(fn, *args):
+    with image_tasks_lock:
+        image_tasks['submitted'] += 1
+    future = image_executor.submit(fn, *args)
+    future.add_done_callback(image_task_done)
+    return future
+
+def image_queue_depth():
+    with image_tasks_lock:
+        return image_tasks['submitted'] - image_tasks['finished']
+
+# All chat and image calls share one client: pooled connections, LLM_MAX_CONCURRENCY calls at a time,
+# retries with backoff on 429/5xx, and identical in-flight requests answered by a single call
+llm_client = client_from_env()
+
+# One conversation per browser session
+conversation_store = ConversationStore(
+    os.path.join(CACHE_FOLDER, 'conversations.sqlite'),
+    lambda history, on_append: DatabaseInterface(response_cache=response_cache,
+                                                 workbook_version=lambda: workbook_cache.stamp(WORKBOOK_FILE),
+                                                 client=llm_client,
+                                                 history=history,
+                                                 on_append=on_append),
+    max_sessions=int(os.getenv('MAX_HOT_SESSIONS', 100)),
+    shared=MULTI_WORKER,
+)
+script_registry = ScriptRegistry(os.path.join(CACHE_FOLDER, 'script_registry.sqlite'))
+
+# Background workers for script generation, kept small so /send_message still gets Flask threads
+job_queue = JobQueue(max_workers=int(os.getenv('JOB_WORKERS', 2)),
+                     on_change=worker_state.save_job if worker_state else None)
+
+# Warm interpreters with openpyxl and the workbook already loaded, used by run_script
+script_pool = ScriptWorkerPool(WORKBOOK_FILE,
+                               size=int(os.getenv('SCRIPT_POOL_SIZE', 2)),
+                               timeout=int(os.getenv('SCRIPT_TIMEOUT', 300)),
+                               max_memory_mb=int(os.getenv('SCRIPT_MAX_MEMORY_MB', 1024)))
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -35,21 +129,24 @@ def allowed_file(filename):
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Initialize the scheduler
-scheduler = BackgroundScheduler()
-scheduler.start()
+# The scheduler is started with the other background services, see start_background_services
+scheduler = None
 
-def delete_file(filepath):
-    try:
-        os.remove(filepath)
-        logger.info(f"Removed temporary file: {filepath}")
-    except Exception as e:
-        logger.error(f"Error deleting file {filepath}: {str(e)}")
+# Uploads expire after an hour, one sweep job deletes them in batches
+upload_store = UploadStore(UPLOAD_FOLDER, ttl=3600, quota_bytes=int(os.getenv('UPLOAD_QUOTA_MB', 512)) * 1024 * 1024)
+
+def schedule_jobs():
+    # With several workers only the leader sweeps, rescanning the folder for other workers' uploads
+    global scheduler
+    from apscheduler.schedulers.background import BackgroundScheduler
+    scheduler = BackgroundScheduler()
+    scheduler.start()
+    scheduler.add_job(upload_store.sweep, 'interval', seconds=60, id='sweep_uploads', kwargs={'rescan': MULTI_WORKER})
+    if worker_state:
+        scheduler.add_job(worker_state.prune, 'interval', seconds=600, id='prune_worker_state')
+        logger.info(f"Worker {worker_state.worker_id} elected to run scheduled jobs")
 
-def schedule_file_deletion(filepath):
-    # Schedule file deletion after 1 hour
-    scheduler.add_job(delete_file, 'date', run_date=datetime.now() + timedelta(hours=1), args=[filepath])
-    logger.info(f"Scheduled deletion of {filepath} in 1 hour")
+scheduler_lock = LeaderLock(os.path.join(CACHE_FOLDER, 'scheduler.lock')) if worker_state else None
 
 # Create a file handler
 file_handler = RotatingFileHandler('app.log', maxBytes=10240, backupCount=10)
@@ -68,42 +165,103 @@ console_handler.setFormatter(formatter)
 logger.addHandler(file_handler)
 logger.addHandler(console_handler)
 
-# Global flag to indicate if a script is running
-script_running = threading.Event()
-
-# Dictionary to store script processes and their input/output queues
-script_processes = {}
+def get_session_id():
+    if 'sid' not in session:
+        session['sid'] = str(uuid.uuid4())
+    return session['sid']
+
+def get_db():
+    # The conversation of the current browser session
+    return conversation_store.get(get_session_id())
+
+# Running scripts keyed by browser session and run id
+process_registry = ProcessRegistry(max_per_session=int(os.getenv('SCRIPT_MAX_PER_SESSION', 3)),
+                                   max_total=int(os.getenv('SCRIPT_MAX_TOTAL', 20)),
+                                   idle_timeout=int(os.getenv('SCRIPT_IDLE_TIMEOUT', 600)),
+                                   max_output=int(os.getenv('SCRIPT_MAX_OUTPUT_KB', 1024)) * 1024)
+
+# Per-stage timings are exported at /metrics. Requests are traced when METRICS_TRACE=1 or when the
+# client sends an X-Trace-Id header, traced responses carry the id and a Server-Timing breakdown
+METRICS_TRACE = os.getenv('METRICS_TRACE') == '1'
+HTTP_REQUEST_SECONDS = metrics.histogram('http_request_seconds', 'Time to produce a response, streamed bodies excluded')
+QUEUE_DEPTH = metrics.gauge('queue_depth', 'Work waiting or in progress per queue')
+QUEUE_DEPTH.set_function(job_queue.depth, queue='jobs')
+QUEUE_DEPTH.set_function(lambda: append_queue.stats()['pending'], queue='appends')
+QUEUE_DEPTH.set_function(image_queue_depth, queue='images')
+QUEUE_DEPTH.set_function(lambda: process_registry.stats()['running'], queue='script_runs')
+metrics.gauge('script_pool_idle', 'Warm script workers ready to run').set_function(lambda: script_pool.stats()['idle'])
+metrics.gauge('conversations_hot', 'Conversations held in memory').set_function(lambda: conversation_store.stats()['hot_sessions'])
+metrics.gauge('upload_bytes', 'Bytes held in the upload folder').set_function(lambda: upload_store.stats()['bytes'])
+metrics.gauge('llm_in_flight', 'Distinct chat completion calls in progress').set_function(lambda: llm_client.stats()['in_flight'])
+WORKER_FORWARDS = metrics.counter('worker_forwarded_total', 'Requests handed to the worker that owns the script run or job')
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    trace_id = request.headers.get('X-Trace-Id')
+    if METRICS_TRACE or trace_id:
+        g.trace, g.trace_token = metrics.start_trace(trace_id)
+
+@app.after_request
+def record_request_metrics(response):
+    elapsed = time.perf_counter() - g.request_start
+    HTTP_REQUEST_SECONDS.observe(elapsed, endpoint=request.endpoint or 'unknown', method=request.method, status=response.status_code)
+    if 'trace' in g:
+        response.headers['X-Trace-Id'] = g.trace.trace_id
+        server_timing = g.trace.server_timing()
+        if server_timing:
+            response.headers['Server-Timing'] = server_timing
+        logger.info(f"trace={g.trace.trace_id} {request.method} {request.path} {response.status_code} {elapsed * 1000:.1f}ms {g.trace.summary()}")
+    return response
+
+@app.teardown_request
+def end_request_trace(exception=None):
+    # Runs even when the view raised, so the trace never leaks into the next request on this thread
+    if 'trace' in g:
+        metrics.end_trace(g.trace_token)
 
 def run_script_with_input(script_path):
-    script_running.set()
-    try:
-        process = subprocess.Popen(['python', '-u', script_path], #added -u
-                                   stdin=subprocess.PIPE, 
-                                   stdout=subprocess.PIPE, 
-                                   stderr=subprocess.PIPE, 
-                                   text=True, 
-                                   bufsize=1, 
-                                   universal_newlines=True)
-        
-        input_queue = queue.Queue()
-        output_queue = queue.Queue()
-        
-        def output_reader(stream, queue):
-            
-            for line in iter(stream.readline, ''): 
-                queue.put(line)
-            stream.close()
-        
-        threading.Thread(target=output_reader, args=(process.stdout, output_queue), daemon=True).start()
-        threading.Thread(target=output_reader, args=(process.stderr, output_queue), daemon=True).start()
-        
-        return process, input_queue, output_queue
-    finally:
-        script_running.clear()
+    # Hand the script to a pre-started worker instead of paying interpreter and openpyxl startup.
+    # Scripts add_data generated write to the workbook, the worker takes the append queue's lock for them
+    lock_dir = CACHE_FOLDER if script_registry.generated('add_data.py', os.path.basename(script_path)) else None
+    return script_pool.start(script_path, lock_dir=lock_dir)
+
+# Modules of the app that double as scripts the user runs from the script list
+SCRIPT_MODULES = ('extract_data.py', 'add_data.py', 'excel_format.py')
+# Every other module app.py imports, and the worker the script pool starts, is not a runnable script
+EXCLUDED_SCRIPTS = (local_imports(__file__, os.path.dirname(os.path.abspath(__file__)))
+                    | {os.path.basename(WORKER_SCRIPT)}) - set(SCRIPT_MODULES)
+
+# Script listing is cached and kept current by the file watcher
+script_catalog = ScriptCatalog(os.getcwd(), EXCLUDED_SCRIPTS)
+file_watcher = FileWatcher(os.getcwd())
+file_watcher.subscribe(script_catalog.on_change)
+
+workbook_sync_timer = None
+
+def sync_workbook_mirror():
+    rebuilt = workbook_mirror.sync()
+    if rebuilt:
+        logger.info(f"Workbook changed, re-synced sheets: {rebuilt}")
+
+def on_file_change(kind, name):
+    global workbook_sync_timer
+    if name == WORKBOOK_FILE and kind != 'deleted':
+        # A save fires several events, sync once things settle
+        if workbook_sync_timer is not None:
+            workbook_sync_timer.cancel()
+        workbook_sync_timer = threading.Timer(0.5, sync_workbook_mirror)
+        workbook_sync_timer.daemon = True
+        workbook_sync_timer.start()
+    elif name.endswith('.py') and kind == 'created':
+        logger.info(f"New Python file created: {name}")
+    elif name in EXCLUDED_SCRIPTS and kind == 'modified':
+        logger.info(f"App module {name} changed, restart the server to load it")
+
+file_watcher.subscribe(on_file_change)
 
 def get_scripts():
-    excluded_scripts = ['app.py', 'database_interface.py', 'image_llm.py']
-    return [f for f in os.listdir() if f.endswith('.py') and f not in excluded_scripts]
+    return script_catalog.scripts()
 
 @app.route('/')
 def index():
@@ -115,31 +273,67 @@ def send_message():
     message = request.json['message']
     logger.info(f"Received message: {message}")
     
-    response = db.send_message(message)
+    response = get_db().send_message(message)
     logger.info(f"Database response: {response}")
     
     scripts = get_scripts()
     return jsonify({'response': response, 'scripts': scripts})
 
-def handleExtractDataScript():
-    data = request.get_json()
-    if not data:
-        return jsonify({'error': 'No JSON data provided'}), 400
-    
-    file_name = data.get('file_name')
-    user_prompt = data.get('user_prompt')
-    
-    if not file_name or not user_prompt:
-        return jsonify({'error': 'Missing file_name or user_prompt'}), 400
-    
+def sse_event(data, event=None):
+    # Format one server-sent event, data is JSON encoded so newlines in tokens survive
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+@app.route('/send_message_stream', methods=['GET', 'POST'])
+def send_message_stream():
+    # GET lets the browser use EventSource, POST mirrors /send_message
+    if request.method == 'POST':
+        message = (request.get_json(silent=True) or {}).get('message')
+    else:
+        message = request.args.get('message')
+    if not message:
+        return jsonify({'error': 'No message provided'}), 400
+    logger.info(f"Received streaming message: {message}")
+    db = get_db()
+
+    def generate():
+        chunks = []
+        for token in db.stream_message(message):
+            chunks.append(token)
+            yield sse_event({'token': token})
+        response = ''.join(chunks)
+        logger.info(f"Database streamed response: {response}")
+        yield sse_event({'response': response, 'scripts': get_scripts()}, event='done')
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def generate_script(script_name, file_name, user_prompt):
+    # Returns (result, cached), the caller records the result in the conversation.
+    # Aider takes most of a second to import, it is loaded by the first generation or by warm_up
+    from extract_data import AiderRunner
     runner = AiderRunner(file_name, user_prompt)
+    script_path = os.path.join(os.getcwd(), file_name)
+
+    # An equivalent prompt against the same schema already produced this file: restore it instead of calling
+    # Aider. Like a fresh generation the script is only written, not run, so an add_data hit appends nothing
+    stored = script_registry.lookup(script_name, file_name, user_prompt, runner.notes_file)
+    if stored is not None:
+        content, result = stored
+        with open(script_path, 'w') as f:
+            f.write(content)
+        logger.info(f"{script_name} restored stored script {file_name} for prompt: {user_prompt}")
+        return result, True
+
     result = runner.run()
-    
-    logger.info("extract_data.py execution successful")
-    db.add_script_run('extract_data.py', result)
-    return jsonify({'response': f"Script output:\n{result}"})
+    if os.path.isfile(script_path):
+        with open(script_path) as f:
+            script_registry.store(script_name, file_name, user_prompt, runner.notes_file, f.read(), result)
 
-def handleAddDataScript():
+    logger.info(f"{script_name} execution successful")
+    return result, False
+
+def handleGenerateScript(script_name, run_async=False):
     data = request.get_json()
     if not data:
         return jsonify({'error': 'No JSON data provided'}), 400
@@ -149,13 +343,117 @@ def handleAddDataScript():
     
     if not file_name or not user_prompt:
         return jsonify({'error': 'Missing file_name or user_prompt'}), 400
+
+    # With "async": true the generation runs as a background job
+    db = get_db()
+    if run_async or data.get('async'):
+        job = job_queue.submit(
+            script_name,
+            user_prompt,
+            lambda job: generate_script(script_name, file_name, user_prompt)[0],
+            on_complete=lambda job: db.add_script_run(script_name, job.result),
+        )
+        logger.info(f"Queued {script_name} job {job.id}")
+        return jsonify({'job_id': job.id, 'status_url': url_for('job_status', job_id=job.id)}), 202
     
-    runner = AiderRunner(file_name, user_prompt)
-    result = runner.run()
-    
-    logger.info("add_data.py execution successful")
-    db.add_script_run('add_data.py', result)
-    return jsonify({'response': f"Script output:\n{result}"})
+    result, cached = generate_script(script_name, file_name, user_prompt)
+    db.add_script_run(script_name, result)
+    response = {'response': f"Script output:\n{result}"}
+    if cached:
+        response['cached'] = True
+    return jsonify(response)
+
+def handleExtractDataScript():
+    return handleGenerateScript('extract_data.py')
+
+def handleAddDataScript():
+    return handleGenerateScript('add_data.py')
+
+@app.route('/jobs/<script_name>', methods=['POST'])
+def submit_job(script_name):
+    if script_name not in ('extract_data.py', 'add_data.py'):
+        return jsonify({'error': 'Only extract_data.py and add_data.py run as jobs'}), 400
+    return handleGenerateScript(script_name, run_async=True)
+
+# Requests between workers carry this header and are never forwarded again
+FORWARDED_HEADER = 'X-Forwarded-Worker'
+FORWARD_HEADERS = ('Cookie', 'Content-Type', 'Accept', 'X-Trace-Id')
+
+def forward_to_owner(owner):
+    # Hands the request to the worker at owner, None when there is no live worker to ask
+    if owner is None or request.headers.get(FORWARDED_HEADER):
+        return None
+    import requests
+    headers = {name: request.headers[name] for name in FORWARD_HEADERS if name in request.headers}
+    headers[FORWARDED_HEADER] = worker_state.worker_id
+    try:
+        upstream = requests.request(request.method, owner + request.full_path, data=request.get_data(),
+                                    headers=headers, stream=True, timeout=(5, None))
+    except requests.RequestException as e:
+        logger.error(f"Error forwarding {request.path} to {owner}: {str(e)}")
+        return None
+    WORKER_FORWARDS.inc(endpoint=request.endpoint)
+
+    def relay():
+        # Streamed as it arrives so script output events are not held back
+        try:
+            yield from upstream.iter_content(chunk_size=None)
+        finally:
+            upstream.close()
+
+    headers = {name: upstream.headers[name] for name in ('Cache-Control', 'X-Accel-Buffering') if name in upstream.headers}
+    return Response(stream_with_context(relay()), status=upstream.status_code,
+                    content_type=upstream.headers.get('Content-Type'), headers=headers)
+
+def find_job(job_id, lookup=job_queue.get):
+    # Returns (job, forwarded response). A job submitted to another worker is answered by that worker,
+    # or from its shared record when that worker has stopped
+    job = lookup(job_id)
+    if job is not None or worker_state is None:
+        return job, None
+    forwarded = forward_to_owner(worker_state.job_owner(job_id))
+    if forwarded is not None:
+        return None, forwarded
+    return worker_state.load_job(job_id), None
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job, forwarded = find_job(job_id)
+    if forwarded is not None:
+        return forwarded
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    status = job.to_dict()
+    if job.status == 'done':
+        status['response'] = f"Script output:\n{job.result}"
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job, forwarded = find_job(job_id)
+    if forwarded is not None:
+        return forwarded
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.status == 'done':
+        return jsonify({'response': f"Script output:\n{job.result}"})
+    if job.status == 'failed':
+        return jsonify({'error': f"Job failed: {job.error}"}), 500
+    if job.status == 'cancelled':
+        return jsonify({'error': 'Job was cancelled'}), 410
+    return jsonify(job.to_dict()), 202
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job, forwarded = find_job(job_id, lookup=job_queue.cancel)
+    if forwarded is not None:
+        return forwarded
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.status != 'cancelled':
+        return jsonify({**job.to_dict(), 'error': f"Job is {job.status}, only pending jobs can be cancelled"}), 409
+    logger.info(f"Cancelled job {job_id}")
+    return jsonify(job.to_dict())
 
 @app.route('/run_script/<script_name>', methods=['POST'])
 def run_script(script_name):
@@ -181,44 +479,39 @@ def run_script(script_name):
             else:
                 return handleAddDataScript()
         else:
-            process, input_queue, output_queue = run_script_with_input(script_path)
-            script_processes[script_name] = (process, input_queue, output_queue)
+            try:
+                run = process_registry.register(get_session_id(), script_name, lambda: run_script_with_input(script_path))
+            except RuntimeError as e:
+                return jsonify({'error': str(e)}), 429
+            if worker_state:
+                worker_state.record_run(run)
+            run_info = {'run_id': run.run_id, 'stream_url': url_for('script_output', run_id=run.run_id)}
             
-            # Wait for initial output or a short timeout
+            # Wait for initial output, returning as soon as the script finishes or goes quiet
             try:
-                initial_output = []
-                timeout = time.time() + 2  # 2 second timeout
-                while time.time() < timeout:
-                    try:
-                        line = output_queue.get(block=False)
-                        initial_output.append(line)
-                        if '?' in line:  # Check if the line contains a question mark
-                            return jsonify({
-                                'input_required': True,
-                                'prompt': ''.join(initial_output),
-                                'response': ''.join(initial_output)
-                            })
-                    except queue.Empty:
-                        if initial_output:
-                            break
-                        time.sleep(0.1)
+                output, finished = run.read(first_timeout=2.0)
                 
-                if initial_output:
-                    result = ''.join(initial_output)
-                    db.add_script_run(script_name, result)
-                    return jsonify({'response': result})
+                if finished:
+                    result = output or 'Script completed with no output.'
+                    get_db().add_script_run(script_name, result)
+                    return jsonify({'response': result, **run_info})
+                elif not output:
+                    return jsonify({
+                        'input_required': True,
+                        'prompt': 'Script is waiting for input:',
+                        'response': 'Script is waiting for input:',
+                        **run_info
+                    })
+                elif '?' in output:  # Check if the output contains a question mark
+                    return jsonify({
+                        'input_required': True,
+                        'prompt': output,
+                        'response': output,
+                        **run_info
+                    })
                 else:
-                    # Check if the process has terminated
-                    if process.poll() is not None:
-                        result = 'Script completed with no output.'
-                        db.add_script_run(script_name, result)
-                        return jsonify({'response': result})
-                    else:
-                        return jsonify({
-                            'input_required': True,
-                            'prompt': 'Script is waiting for input:',
-                            'response': 'Script is waiting for input:'
-                        })
+                    get_db().add_script_run(script_name, output)
+                    return jsonify({'response': output, **run_info})
             
             except Exception as e:
                 logger.error(f"Error reading script output: {str(e)}")
@@ -230,33 +523,36 @@ def run_script(script_name):
 
 @app.route('/script_input/<script_name>', methods=['POST'])
 def script_input(script_name):
-    if script_name not in script_processes:
+    # Clients that only know the script name get the session's latest run of it
+    run_id = request.json.get('run_id')
+    if run_id:
+        run = process_registry.get(get_session_id(), run_id)
+    else:
+        run = process_registry.latest(get_session_id(), script_name)
+    if (run is None or run.is_finished()) and worker_state:
+        # The run may belong to another worker
+        forwarded = forward_to_owner(worker_state.run_owner(get_session_id(), run_id, script_name))
+        if forwarded is not None:
+            return forwarded
+    if run is None or run.is_finished():
         return jsonify({'error': 'No running script found with this name'}), 404
     
-    process, input_queue, output_queue = script_processes[script_name]
     user_input = request.json.get('input')
     
     if not user_input:
         return jsonify({'error': 'No input provided'}), 400
     
     try:
-        process.stdin.write(user_input + '\n')
-        process.stdin.flush()
+        run.write(user_input + '\n')
         
-        # Wait for output or a short timeout
+        # Wait for output, returning as soon as the script finishes or goes quiet
         try:
-            output = []
-            while True:
-                try:
-                    line = output_queue.get(timeout=0.5)
-                    output.append(line)
-                except queue.Empty:
-                    break
+            output, finished = run.read(first_timeout=1.0)
             
-            if not output:
-                return jsonify({'input_required': True, 'prompt': 'Script is waiting for more input:'})
+            if not output and not finished:
+                return jsonify({'input_required': True, 'prompt': 'Script is waiting for more input:', 'run_id': run.run_id})
             else:
-                return jsonify({'response': ''.join(output)})
+                return jsonify({'response': output or 'Script completed with no output.', 'finished': finished, 'run_id': run.run_id})
         
         except Exception as e:
             logger.error(f"Error reading script output: {str(e)}")
@@ -266,6 +562,92 @@ def script_input(script_name):
         logger.error(f"Error sending input to script: {str(e)}")
         return jsonify({'error': f"Error sending input to script: {str(e)}"}), 500
 
+@app.route('/script_output/<run_id>')
+def script_output(run_id):
+    # Server-sent events with the script's output from the start, as it is written. Works alongside /script_input,
+    # each reads the run's output buffer at its own offset
+    run = process_registry.get(get_session_id(), run_id)
+    if run is None and worker_state:
+        forwarded = forward_to_owner(worker_state.run_owner(get_session_id(), run_id))
+        if forwarded is not None:
+            return forwarded
+    if run is None:
+        return jsonify({'error': 'No script run found with this id'}), 404
+
+    def generate():
+        for chunk in run.stream():
+            yield sse_event({'output': chunk}) if chunk else ": keep-alive\n\n"
+        yield sse_event({'returncode': run.process.returncode}, event='done')
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/query', methods=['POST'])
+def query_workbook():
+    data = request.get_json()
+    if not data:
+        return jsonify({'error': 'No JSON data provided'}), 400
+
+    sheet_name = data.get('sheet')
+    if not sheet_name:
+        return jsonify({'error': 'Missing sheet'}), 400
+
+    try:
+        rows = workbook_mirror.query(sheet_name, where=data.get('where'), columns=data.get('columns'), limit=data.get('limit', 100))
+        logger.info(f"Query on sheet {sheet_name} returned {len(rows)} rows")
+        return jsonify({'sheet': sheet_name, 'rows': rows})
+    except KeyError as e:
+        return jsonify({'error': e.args[0]}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error querying workbook: {str(e)}")
+        return jsonify({'error': f"Error querying workbook: {str(e)}"}), 500
+
+@app.route('/append_rows', methods=['POST'])
+def append_rows():
+    data = request.get_json()
+    if not data:
+        return jsonify({'error': 'No JSON data provided'}), 400
+
+    sheet_name = data.get('sheet')
+    rows = data.get('rows')
+    if not sheet_name or not rows or not isinstance(rows, list):
+        return jsonify({'error': 'Missing sheet or rows'}), 400
+    try:
+        for row in rows:
+            check_row(row)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    future = append_queue.submit(sheet_name, rows)
+    try:
+        result = future.result(timeout=60)
+        logger.info(f"Appended {len(result['rows'])} rows to {sheet_name} in batch {result['batch_id']}")
+        return jsonify(result)
+    except KeyError as e:
+        return jsonify({'error': e.args[0]}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error appending rows: {str(e)}")
+        return jsonify({'error': f"Error appending rows: {str(e)}"}), 500
+
+@app.route('/cache_stats')
+def cache_stats():
+    return jsonify({
+        'workbook_cache': workbook_cache.stats(),
+        'response_cache': response_cache.stats() if response_cache else None,
+        'transcription_cache': transcription_cache.stats(),
+        'uploads': upload_store.stats(),
+        'llm': llm_client.stats(),
+        'worker': {'worker_id': worker_state.worker_id, 'leader': scheduler_lock.is_leader} if worker_state else None,
+    })
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/analyze_image', methods=['POST'])
 def analyze_image():
     if 'file' not in request.files:
@@ -277,12 +659,15 @@ def analyze_image():
         return jsonify({'error': 'No selected file'})
     if file and allowed_file(file.filename):
         filename = secure_filename(str(uuid.uuid4()) + os.path.splitext(file.filename)[1])
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        try:
+            filepath = upload_store.save(file, filename)
+        except RuntimeError as e:
+            logger.error(f"Rejected upload {file.filename}: {str(e)}")
+            return jsonify({'error': str(e)}), 507
         
         try:
             # Analyze the image
-            image_llm = ImageLLM(filepath)
+            image_llm = ImageLLM(filepath, cache=transcription_cache, max_dimension=IMAGE_MAX_DIMENSION, quality=IMAGE_QUALITY, client=llm_client)
             results = image_llm.transcribe_image()
             
             # Create a URL for the image
@@ -291,25 +676,139 @@ def analyze_image():
             logger.info(f"Image analysis completed for {filename}")
             logger.info(f"Image URL: {image_url}")
 
-            # Schedule file deletion after 1 hour
-            schedule_file_deletion(filepath)
-
             # Add image analysis to conversation history
-            db.add_image_analysis(filename, results)
+            get_db().add_image_analysis(filename, results)
 
             return jsonify({'results': results, 'image_url': image_url})
         except Exception as e:
             logger.error(f"Error analyzing image: {str(e)}")
-            os.remove(filepath)  # Delete the file immediately if there's an error
+            upload_store.remove(filepath)  # Delete the file immediately if there's an error
             return jsonify({'error': f"Error analyzing image: {str(e)}"}), 500
     
     logger.error(f"Invalid file type: {file.filename}")
     return jsonify({'error': 'Invalid file type'}), 400
 
+def transcribe_upload(filepath, filename, db):
+    # Runs on image_executor, records the result in the submitting session's conversation
+    try:
+        image_llm = ImageLLM(filepath, cache=transcription_cache, max_dimension=IMAGE_MAX_DIMENSION, quality=IMAGE_QUALITY, client=llm_client)
+        results = image_llm.transcribe_image()
+    except Exception:
+        upload_store.remove(filepath)  # Delete the file immediately if there's an error
+        raise
+    logger.info(f"Image analysis completed for {filename}")
+    db.add_image_analysis(filename, results)
+    return results
+
+@app.route('/analyze_images', methods=['POST'])
+def analyze_images():
+    files = [file for file in request.files.getlist('files') if file.filename]
+    if not files:
+        logger.error("No files in the request")
+        return jsonify({'error': 'No files provided'}), 400
+
+    invalid = [file.filename for file in files if not allowed_file(file.filename)]
+    if invalid:
+        logger.error(f"Invalid file types: {invalid}")
+        return jsonify({'error': f"Invalid file type: {', '.join(invalid)}"}), 400
+
+    # Every file is saved before any is analyzed, so a batch that does not fit the quota is rejected whole
+    saved = []
+    try:
+        for file in files:
+            filename = secure_filename(str(uuid.uuid4()) + os.path.splitext(file.filename)[1])
+            saved.append((file.filename, filename, upload_store.save(file, filename)))
+    except RuntimeError as e:
+        for _, _, filepath in saved:
+            upload_store.remove(filepath)
+        logger.error(f"Rejected image batch: {str(e)}")
+        return jsonify({'error': str(e)}), 507
+
+    db = get_db()
+    futures = {}
+    for original_name, filename, filepath in saved:
+        future = submit_image_task(transcribe_upload, filepath, filename, db)
+        futures[future] = (original_name, filename)
+
+    # Stream each result as soon as its transcription finishes
+    def generate():
+        for future in as_completed(futures):
+            original_name, filename = futures[future]
+            try:
+                results = future.result()
+                yield sse_event({
+                    'file': original_name,
+                    'results': results,
+                    'image_url': url_for('uploaded_file', filename=filename, _external=True),
+                })
+            except Exception as e:
+                logger.error(f"Error analyzing image {original_name}: {str(e)}")
+                yield sse_event({'file': original_name, 'error': f"Error analyzing image: {str(e)}"})
+        yield sse_event({'count': len(futures)}, event='done')
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
+def start_worker_server():
+    # Other workers reach this one here when they forward requests for its script runs and jobs
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    worker_state.register(f"http://127.0.0.1:{server.server_port}")
+    atexit.register(worker_state.unregister)
+
+if worker_state:
+    start_worker_server()
+
+# Background services start a moment after the server does, so the first request does not wait on them.
+# WARMUP=1 also preloads the heavy modules and the workbook then, instead of leaving that to the first
+# request that needs them
+STARTUP_DELAY = float(os.getenv('STARTUP_DELAY', 1.0))
+WARMUP = os.getenv('WARMUP') == '1'
+
+def warm_up():
+    start = time.perf_counter()
+    try:
+        llm_client.warm_up()
+        importlib.import_module('extract_data')
+        importlib.import_module('add_data')
+        from context_builder import get_encoding
+        get_encoding('gpt-4')
+        sync_workbook_mirror()
+    except Exception as e:
+        logger.error(f"Warm-up failed: {str(e)}")
+        return
+    logger.info(f"Warm-up finished in {time.perf_counter() - start:.2f}s")
+
+def start_background_services():
+    file_watcher.start()
+    process_registry.start_reaper()
+    if scheduler_lock:
+        scheduler_lock.run_when_elected(schedule_jobs)
+    else:
+        schedule_jobs()
+    script_pool.fill()
+    if WARMUP:
+        warm_up()
+
+startup_timer = None
+
+def schedule_background_services():
+    # Called by whatever serves the app rather than on import, so importing app.py from a benchmark
+    # helper or a test starts no file watcher, reaper, scheduler or script workers
+    global startup_timer
+    if startup_timer is None:
+        startup_timer = threading.Timer(STARTUP_DELAY, start_background_services)
+        startup_timer.daemon = True
+        startup_timer.start()
+
+# A pre-fork server imports app:app in each worker, that import is the worker's entry point
+if worker_state:
+    schedule_background_services()
+
 def custom_reloader(app):
     stop_event = threading.Event()
 
@@ -323,27 +822,12 @@ def custom_reloader(app):
     def run_app():
         app.run(debug=True, use_reloader=False)
 
-    def watch_files():
-        previous = set(os.listdir())
-        while not stop_event.is_set():
-            time.sleep(1)
-            current = set(os.listdir())
-            new_files = current - previous
-            if new_files:
-                # Check if the new files are Python files created by add_data.py
-                if any(file.endswith('.py') for file in new_files):
-                    logger.info(f"New Python file(s) created: {new_files}")
-                else:
-                    while script_running.is_set():
-                        time.sleep(0.1)
-                    os._exit(3)
-            previous = current
-
+    # File changes are handled in place by file_watcher, the server is no longer restarted
+    logger.info(f"Watching {file_watcher.directory} for changes ({file_watcher.mode})")
     app_thread = threading.Thread(target=run_app, daemon=True)
-    watch_thread = threading.Thread(target=watch_files, daemon=True)
 
     app_thread.start()
-    watch_thread.start()
+    schedule_background_services()
 
     try:
         while not stop_event.is_set():
@@ -0,0 +1,43 @@
+#Stand-in for the Aider Coder used by extract_data.py and add_data.py. It waits a configurable time to mimic the model call and then writes a small openpyxl script into the target file, so the whole generate-and-run path works offline.
+import time
+
+SCRIPT_TEMPLATE = '''import openpyxl
+
+# Generated by the benchmark fake coder for: {prompt!r}
+wb = openpyxl.load_workbook('studio_database_1.xlsx')
+for sheet in wb:
+    print(f"{{sheet.title}}: {{sheet.max_row - 1}} rows")
+'''
+
+
+class FakeModel:
+    def __init__(self, name, *args, **kwargs):
+        self.name = name
+
+
+class FakeCoder:
+    def __init__(self, fnames, latency):
+        self.fnames = list(fnames)
+        self.latency = latency
+        self.done_messages = []
+        self.cur_messages = []
+
+    def run(self, instruction):
+        time.sleep(self.latency)
+        for fname in self.fnames:
+            with open(fname, 'w') as f:
+                f.write(SCRIPT_TEMPLATE.format(prompt=instruction))
+        return f"Updated {', '.join(self.fnames)}"
+
+
+def install(latency=1.0):
+    # Swap the Aider classes the runners look up at call time, the coder pool and registry stay in the loop
+    import extract_data
+    import add_data
+
+    def create(*args, fnames=(), **kwargs):
+        return FakeCoder(fnames, latency)
+
+    for module in (extract_data, add_data):
+        module.Model = FakeModel
+        module.Coder.create = staticmethod(create)
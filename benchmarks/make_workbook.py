@@ -0,0 +1,96 @@
+#Generates synthetic workbooks in the studio_database_1.xlsx layout. The requested row count is spread over the Students, Attendance, Memberships and Payments sheets, with Classes and Inventory kept at their usual size.
+import argparse
+import datetime
+import random
+
+import openpyxl
+
+FIRST_NAMES = ['John', 'Maria', 'Ana', 'Pedro', 'Lucas', 'Sofia', 'Mia', 'Carlos', 'Julia', 'Rafael', 'Laura', 'Diego']
+LAST_NAMES = ['Doe', 'Silva', 'Santos', 'Oliveira', 'Souza', 'Costa', 'Pereira', 'Lima', 'Gomes', 'Ribeiro']
+CORDS = ['white', 'yellow', 'orange', 'blue', 'green', 'purple', 'brown', 'red']
+CLASSES = [
+    ('Capoeira Basics', 'Monday', '18:00 - 19:00', 'Maria'),
+    ('Capoeira Basics', 'Wednesday', '18:00 - 19:00', 'Maria'),
+    ('Music and Rhythm', 'Tuesday', '19:00 - 20:00', 'Pedro'),
+    ('Acrobatics', 'Thursday', '18:00 - 19:30', 'Ana'),
+    ('Roda', 'Friday', '19:00 - 21:00', 'Pedro'),
+    ('Kids Capoeira', 'Saturday', '10:00 - 11:00', 'Sofia'),
+]
+INVENTORY = [('BATZ T-shirt 2020', 20, 25), ('Abada pants', 15, 40), ('Berimbau', 4, 120), ('Pandeiro', 6, 60), ('Cord', 50, 10)]
+STUDENT_HEADERS = ['Name', 'Gender', 'Capoeira Name', 'Birthdate', 'Age', 'Phone', 'Email', 'Address',
+                   'Emergency Contact Name', 'Emergency Contact Phone', 'Medical Condition', 'Capoeira Experience',
+                   'Cord Level', 'Goals', 'Occupation', 'Referral Source', 'Ethnicity', 'Liability Waiver',
+                   'Payment Method', 'Credit Card Info', 'Current Membership ID', 'Classes Remaining']
+ATTENDANCE_DAYS = 30
+
+
+def student_name(i):
+    return f"{FIRST_NAMES[i % len(FIRST_NAMES)]} {LAST_NAMES[(i // len(FIRST_NAMES)) % len(LAST_NAMES)]} {i}"
+
+
+def student_row(rng, i):
+    birthdate = datetime.date(1970, 1, 1) + datetime.timedelta(days=rng.randrange(15000))
+    return [student_name(i), rng.choice('MF'), f'Apelido {i}', birthdate.isoformat(), 2024 - birthdate.year,
+            f'555-{rng.randrange(1000):03d}-{rng.randrange(10000):04d}', f'student{i}@example.com',
+            f'{rng.randrange(1, 999)} Main st, San Francisco, CA', f'Contact {i}', f'555-{rng.randrange(10000):04d}',
+            rng.choice([None, 'Knee injury', 'Asthma']), f'{rng.randrange(10)} years', rng.choice(CORDS),
+            'Be more flexible', 'engineer', rng.choice(['instagram', 'friend', 'flyer']), None, True,
+            rng.choice(['credit card', 'cash']), f' **** **** **** {rng.randrange(10000):04d}', i, rng.randrange(20)]
+
+
+def generate_workbook(path, rows, seed=0):
+    # Write-only mode streams rows to disk, so a million rows fit in memory
+    rng = random.Random(seed)
+    per_sheet = max(1, rows // 4)
+    start_day = datetime.date(2024, 9, 19)
+    wb = openpyxl.Workbook(write_only=True)
+
+    attendance = wb.create_sheet('Attendance')
+    attendance.append(['Name'] + [(start_day + datetime.timedelta(days=d)).isoformat() for d in range(ATTENDANCE_DAYS)])
+    for i in range(per_sheet):
+        attendance.append([student_name(i)] + [rng.choice(('Present', 'Absent')) for _ in range(ATTENDANCE_DAYS)])
+
+    students = wb.create_sheet('Students')
+    students.append(STUDENT_HEADERS)
+    for i in range(per_sheet):
+        students.append(student_row(rng, i))
+
+    classes = wb.create_sheet('Classes')
+    classes.append(['Name', 'Schedule', 'Time', 'Instructor'])
+    for row in CLASSES:
+        classes.append(list(row))
+
+    inventory = wb.create_sheet('Inventory')
+    inventory.append(['Item', 'Quantity', 'Price'])
+    for row in INVENTORY:
+        inventory.append(list(row))
+
+    memberships = wb.create_sheet('Memberships')
+    memberships.append(['ID', 'Student Name', 'Type', 'Start Date', 'End Date', 'Classes Remaining'])
+    for i in range(per_sheet):
+        start = start_day + datetime.timedelta(days=rng.randrange(365))
+        memberships.append([i, student_name(i), rng.choice(['monthly', '10 classes', 'yearly']), start.isoformat(),
+                            (start + datetime.timedelta(days=30)).isoformat(), rng.randrange(20)])
+
+    payments = wb.create_sheet('Payments')
+    payments.append(['ID', 'Student Name', 'Date', 'Amount', 'Type'])
+    for i in range(rows - 3 * per_sheet):
+        day = start_day + datetime.timedelta(days=rng.randrange(365))
+        payments.append([i, student_name(i % per_sheet), day.isoformat(), rng.choice([25, 60, 100, 120]),
+                         rng.choice(['credit card', 'cash'])])
+
+    wb.save(path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic studio workbook.')
+    parser.add_argument('rows', type=int, help='Total data rows across the growing sheets')
+    parser.add_argument('--output', default='studio_database_1.xlsx')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_workbook(args.output, args.rows, args.seed)
+    print(f"Wrote {args.rows} rows to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+#Load tests the app offline. For each workbook size it generates a synthetic workbook, starts app.py in a scratch directory against the stub OpenAI server and fake coder, drives the endpoints concurrently and records latency percentiles, throughput and memory. Results are written as JSON and can be compared against an earlier run.
+import argparse
+import glob
+import io
+import json
+import math
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from make_workbook import generate_workbook
+from stub_openai import StubOpenAIServer
+
+try:
+    from PIL import Image
+except ImportError:  # Without Pillow the uploads are random bytes, which the app sends on as-is
+    Image = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+LOOKUP_SCRIPT = '''import openpyxl
+
+wb = openpyxl.load_workbook('studio_database_1.xlsx')
+sheet = wb['Students']
+print(f"Students: {sheet.max_row - 1}")
+'''
+
+PROMPT_SCRIPT = '''import openpyxl
+
+name = input('Which student? ')
+wb = openpyxl.load_workbook('studio_database_1.xlsx')
+matches = [row[0] for row in wb['Students'].iter_rows(min_row=2, values_only=True) if row[0] and name in row[0]]
+print(f"{len(matches)} students match {name}")
+'''
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not values:
+        return None
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def process_rss(pid):
+    # Resident memory in MB of pid and of its direct children, read from /proc so psutil is not needed
+    def rss(p):
+        try:
+            with open(f'/proc/{p}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return 0.0
+
+    if not os.path.isdir('/proc'):
+        return None, None
+    children = 0.0
+    for stat_path in glob.glob('/proc/[0-9]*/stat'):
+        try:
+            with open(stat_path) as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children += rss(stat_path.split('/')[2])
+    return rss(pid), children
+
+
+class MemorySampler:
+    def __init__(self, pid, interval=0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = None
+        self.peak_children_rss = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        rss, children = process_rss(self.pid)
+        if rss is not None:
+            self.peak_rss = max(self.peak_rss or 0.0, rss)
+            self.peak_children_rss = max(self.peak_children_rss or 0.0, children)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._sample()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def image_bytes(i):
+    # Every upload is different so the transcription cache does not answer for the stub
+    if Image is None:
+        return random.Random(i).randbytes(200 * 1024)
+    image = Image.effect_noise((1024, 768), 64 + i % 64).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def timed(call, url, **kwargs):
+    # Returns (seconds, ok), a JSON body with an error key counts as a failure
+    start = time.perf_counter()
+    try:
+        response = call(url, timeout=300, **kwargs)
+    except requests.RequestException:
+        return time.perf_counter() - start, False
+    elapsed = time.perf_counter() - start
+    try:
+        ok = response.status_code < 400 and 'error' not in response.json()
+    except ValueError:
+        ok = False
+    return elapsed, ok
+
+
+def bench_send_message(session, base_url, i):
+    return timed(session.post, f'{base_url}/send_message', json={'message': f'How many students came to class on day {i}?'})
+
+
+def bench_run_script(session, base_url, i):
+    return timed(session.post, f'{base_url}/run_script/bench_lookup.py', json={})
+
+
+def bench_script_input(session, base_url, i):
+    # Only the input round trip is timed, starting the prompting script is setup
+    response = session.post(f'{base_url}/run_script/bench_prompt.py', json={}, timeout=300)
+    run_id = response.json().get('run_id')
+    return timed(session.post, f'{base_url}/script_input/bench_prompt.py', json={'input': 'John', 'run_id': run_id})
+
+
+def bench_analyze_image(session, base_url, i):
+    files = {'file': (f'bench_{i}.jpg', image_bytes(i), 'image/jpeg')}
+    return timed(session.post, f'{base_url}/analyze_image', files=files)
+
+
+def bench_extract_data(session, base_url, i):
+    # Goes through the script registry, coder pool and fake coder, prompts are unique so nothing is reused
+    data = {'file_name': f'bench_generated_{i % 4}.py', 'user_prompt': f'List students with more than {i} classes remaining'}
+    return timed(session.post, f'{base_url}/run_script/extract_data.py', json=data)
+
+
+ENDPOINTS = {
+    'send_message': bench_send_message,
+    'run_script': bench_run_script,
+    'script_input': bench_script_input,
+    'analyze_image': bench_analyze_image,
+    'extract_data': bench_extract_data,
+}
+
+
+def run_endpoint(base_url, name, total, concurrency, warmup, pid):
+    bench = ENDPOINTS[name]
+    local = threading.local()
+
+    def one(i):
+        # One session per driver thread, like one browser tab per user
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        return bench(local.session, base_url, i)
+
+    for i in range(warmup):
+        one(-1 - i)
+
+    sampler = MemorySampler(pid).start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    wall = time.perf_counter() - start
+    sampler.stop()
+
+    latencies = sorted(elapsed for elapsed, _ in results)
+    errors = sum(1 for _, ok in results if not ok)
+    return {
+        'endpoint': name,
+        'requests': total,
+        'errors': errors,
+        'concurrency': concurrency,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+        'throughput_rps': round((total - errors) / wall, 2),
+        'peak_rss_mb': sampler.peak_rss and round(sampler.peak_rss, 1),
+        'peak_children_rss_mb': sampler.peak_children_rss and round(sampler.peak_children_rss, 1),
+    }
+
+
+def prepare_workdir(rows, seed):
+    # A scratch copy of the app so generated files, caches and logs never touch the repository
+    workdir = tempfile.mkdtemp(prefix=f'flask_excel_bench_{rows}_')
+    for path in glob.glob(os.path.join(REPO_DIR, '*.py')) + glob.glob(os.path.join(REPO_DIR, 'excel_notes*.txt')):
+        shutil.copy(path, workdir)
+    if os.path.isdir(os.path.join(REPO_DIR, 'templates')):
+        shutil.copytree(os.path.join(REPO_DIR, 'templates'), os.path.join(workdir, 'templates'))
+    for name, content in (('bench_lookup.py', LOOKUP_SCRIPT), ('bench_prompt.py', PROMPT_SCRIPT)):
+        with open(os.path.join(workdir, name), 'w') as f:
+            f.write(content)
+    start = time.perf_counter()
+    generate_workbook(os.path.join(workdir, 'studio_database_1.xlsx'), rows, seed)
+    return workdir, time.perf_counter() - start
+
+
+def start_app(workdir, port, stub_url, coder_latency, timeout):
+    env = dict(os.environ, OPENAI_BASE_URL=stub_url, AI_KEY='benchmark', PYTHONUNBUFFERED='1')
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    process = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'serve_app.py'), '--port', str(port),
+                                '--coder-latency', str(coder_latency)],
+                               cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    base_url = f'http://127.0.0.1:{port}'
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            break
+        try:
+            if requests.get(f'{base_url}/cache_stats', timeout=5).status_code == 200:
+                return process, base_url, time.perf_counter() - start
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    stop_app(process)
+    with open(os.path.join(workdir, 'server.log')) as f:
+        print(f.read()[-4000:])
+    raise RuntimeError(f"App did not start within {timeout} seconds, see {workdir}/server.log")
+
+
+def stop_app(process):
+    # The app and its script workers share a process group
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=10)
+    except ProcessLookupError:
+        pass
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+
+
+def git_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=REPO_DIR, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    # A regression is a latency percentile up, or throughput down, by more than threshold
+    previous = {(r['rows'], r['endpoint']): r for r in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        old = previous.get((result['rows'], result['endpoint']))
+        if old is None:
+            continue
+        for metric, worse_when_higher in (('p50_ms', True), ('p99_ms', True), ('throughput_rps', False)):
+            if not old[metric]:
+                continue
+            change = (result[metric] - old[metric]) / old[metric]
+            regressed = change > threshold if worse_when_higher else change < -threshold
+            flag = 'REGRESSION' if regressed else ''
+            print(f"{result['rows']:>8} {result['endpoint']:<14} {metric:<15} {old[metric]:>10} -> {result[metric]:>10} {change:+.1%} {flag}")
+            if regressed:
+                regressions.append({'rows': result['rows'], 'endpoint': result['endpoint'], 'metric': metric,
+                                    'baseline': old[metric], 'current': result[metric], 'change': round(change, 4)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the app offline against a stub OpenAI server and fake coder.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000, 1000000], help='Workbook sizes to test')
+    parser.add_argument('--endpoints', nargs='+', choices=sorted(ENDPOINTS), default=list(ENDPOINTS))
+    parser.add_argument('--requests', type=int, default=50, help='Timed requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per endpoint before measuring')
+    parser.add_argument('--llm-latency', type=float, default=0.2, help='Stub OpenAI seconds before the first byte')
+    parser.add_argument('--llm-error-rate', type=float, default=0.0, help='Fraction of stub OpenAI calls answered with 429')
+    parser.add_argument('--coder-latency', type=float, default=1.0, help='Fake coder seconds per edit')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--startup-timeout', type=float, default=900)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='Earlier results file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative change counted as a regression')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch directories for inspection')
+    args = parser.parse_args()
+
+    stub = StubOpenAIServer(latency=args.llm_latency, error_rate=args.llm_error_rate).start()
+    results = {
+        'version': git_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': sys.version.split()[0],
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'keep')},
+        'workbooks': [],
+        'results': [],
+    }
+
+    for rows in args.rows:
+        workdir, generate_seconds = prepare_workdir(rows, args.seed)
+        print(f"{rows} rows: workbook generated in {generate_seconds:.1f}s")
+        process, base_url, startup_seconds = start_app(workdir, args.port, stub.base_url, args.coder_latency, args.startup_timeout)
+        try:
+            idle_rss, _ = process_rss(process.pid)
+            results['workbooks'].append({
+                'rows': rows,
+                'workbook_bytes': os.path.getsize(os.path.join(workdir, 'studio_database_1.xlsx')),
+                'generate_seconds': round(generate_seconds, 2),
+                'startup_seconds': round(startup_seconds, 2),
+                'idle_rss_mb': idle_rss and round(idle_rss, 1),
+            })
+            for name in args.endpoints:
+                result = run_endpoint(base_url, name, args.requests, args.concurrency, args.warmup, process.pid)
+                result['rows'] = rows
+                results['results'].append(result)
+                print(f"{rows:>8} {name:<14} p50 {result['p50_ms']}ms p99 {result['p99_ms']}ms "
+                      f"{result['throughput_rps']} req/s errors {result['errors']} rss {result['peak_rss_mb']}MB")
+        finally:
+            stop_app(process)
+            if not args.keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+    results['llm_requests'] = stub.requests
+
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            results['regressions'] = compare(results, json.load(f), args.threshold)
+        status = 1 if results['regressions'] else 0
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    sys.exit(status)
+
+if __name__ == "__main__":
+    main()
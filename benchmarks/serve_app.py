@@ -0,0 +1,25 @@
+#Starts app.py for a benchmark run with the fake coder installed. Run it from the directory holding the app modules and workbook, with OPENAI_BASE_URL pointing at the stub server.
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.getcwd())
+sys.path.insert(1, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_coder
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve app.py with the benchmark fake coder.')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--coder-latency', type=float, default=1.0)
+    args = parser.parse_args()
+
+    # The fake coder has to be in place before app.py imports the runners
+    fake_coder.install(args.coder_latency)
+    import app
+    app.schedule_background_services()
+    app.app.run(host='127.0.0.1', port=args.port, threaded=True, use_reloader=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#Profiles the app's cold start. Starts app.py in a scratch directory with python -X importtime, reports the time from process start to the first request served and the import cost of each module, so slow imports that crept into startup show up.
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import requests
+
+from run_benchmarks import prepare_workdir, stop_app
+
+SERVE_APP = "import sys, app; app.schedule_background_services(); app.app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True, use_reloader=False)"
+
+
+def parse_importtime(text):
+    # Lines look like "import time:  self_us | cumulative_us | <two spaces per nesting level>module"
+    imports = []
+    for line in text.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        name = name.rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append({'module': name.strip(), 'depth': depth,
+                        'self_ms': int(self_us) / 1000, 'cumulative_ms': int(cumulative_us) / 1000})
+    return imports
+
+
+def profile_startup(workdir, port, timeout, env=None):
+    stderr_path = os.path.join(workdir, 'importtime.log')
+    env = dict(os.environ, **(env or {}))
+    with open(stderr_path, 'w') as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', SERVE_APP, str(port)],
+                                   cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=stderr,
+                                   start_new_session=True)
+        first_response = None
+        try:
+            while time.perf_counter() - start < timeout and process.poll() is None:
+                try:
+                    if requests.get(f'http://127.0.0.1:{port}/cache_stats', timeout=5).status_code == 200:
+                        first_response = time.perf_counter() - start
+                        break
+                except requests.RequestException:
+                    time.sleep(0.02)
+        finally:
+            stop_app(process)
+    with open(stderr_path) as f:
+        return first_response, parse_importtime(f.read())
+
+
+def report(first_response, imports, top):
+    total = next((entry['cumulative_ms'] for entry in imports if entry['module'] == 'app'), None)
+    print(f"Process start to first response: {first_response:.2f}s" if first_response else "The app did not answer")
+    if total is not None:
+        print(f"Importing app.py: {total:.0f} ms")
+    app_depth = next((entry['depth'] for entry in imports if entry['module'] == 'app'), 0)
+    print("\nImported by app.py (cumulative ms):")
+    for entry in sorted((e for e in imports if e['depth'] == app_depth + 1), key=lambda e: -e['cumulative_ms'])[:top]:
+        print(f"  {entry['cumulative_ms']:9.1f}  {entry['module']}")
+    # Top-level packages wherever they were first imported, e.g. openai pulled in by llm_client
+    packages = [e for e in imports if '.' not in e['module'] and e['module'] != 'app']
+    print("\nSlowest packages (cumulative ms):")
+    for entry in sorted(packages, key=lambda e: -e['cumulative_ms'])[:top]:
+        print(f"  {entry['cumulative_ms']:9.1f}  {entry['module']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile the app's cold start and per-module import cost.")
+    parser.add_argument('--rows', type=int, default=1000, help='Rows in the generated workbook')
+    parser.add_argument('--port', type=int, default=5056)
+    parser.add_argument('--top', type=int, default=15, help='Modules to list')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--warmup', action='store_true', help='Start the app with WARMUP=1')
+    parser.add_argument('--output', help='Also write the raw import timings as JSON')
+    args = parser.parse_args()
+
+    workdir, _ = prepare_workdir(args.rows, seed=0)
+    try:
+        first_response, imports = profile_startup(workdir, args.port, args.timeout,
+                                                  env={'WARMUP': '1'} if args.warmup else None)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    report(first_response, imports, args.top)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'first_response_seconds': first_response, 'imports': imports}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#Local stand-in for the OpenAI chat completions API. Answers every request with a canned reply after a configurable delay, streamed or not, so the app can be load tested without network access or API costs.
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._send_json(400, {'error': {'message': 'Invalid JSON'}})
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            return self._send_json(404, {'error': {'message': f'Unknown path {self.path}'}})
+
+        self.server.record_request()
+        if random.random() < self.server.error_rate:
+            # Throttle like the real API does under load
+            self.send_response(429)
+            self.send_header('Retry-After', '0.1')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        time.sleep(self.server.delay())
+        model = payload.get('model', 'stub')
+        if payload.get('stream'):
+            self._stream(model)
+        else:
+            self._send_json(200, {
+                'id': f'chatcmpl-{uuid.uuid4().hex}',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': self.server.reply}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+            })
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, model):
+        # One chunk per word, spaced so the whole reply takes about stream_seconds
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        words = self.server.reply.split(' ')
+        chunk_id = f'chatcmpl-{uuid.uuid4().hex}'
+        for i, word in enumerate(words):
+            delta = {'content': word if i == 0 else ' ' + word}
+            self._write_chunk(chunk_id, model, delta, None)
+            time.sleep(self.server.stream_seconds / len(words))
+        self._write_chunk(chunk_id, model, {}, 'stop')
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.close_connection = True
+
+    def _write_chunk(self, chunk_id, model, delta, finish_reason):
+        chunk = {
+            'id': chunk_id,
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+        }
+        self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+        self.wfile.flush()
+
+
+class StubOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.2, jitter=0.05, stream_seconds=0.5, reply=None, error_rate=0.0):
+        # latency is the seconds before the first byte, jitter is added uniformly on top,
+        # error_rate is the fraction of requests answered with 429
+        super().__init__(('127.0.0.1', port), StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.stream_seconds = stream_seconds
+        self.error_rate = error_rate
+        self.reply = reply or 'The studio has 12 students in the Capoeira Basics class on Friday.'
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/v1'
+
+    def delay(self):
+        return self.latency + random.uniform(0, self.jitter)
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a stub OpenAI chat completions API.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--jitter', type=float, default=0.05)
+    parser.add_argument('--stream-seconds', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    server = StubOpenAIServer(args.port, args.latency, args.jitter, args.stream_seconds, error_rate=args.error_rate)
+    print(f"Stub OpenAI server listening on {server.base_url}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#Keeps initialized Aider coders around between requests so the model, io and repo map setup is paid once per pooled coder instead of once per request. Coders are keyed by target file and read-only notes file.
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+AIDER_SETUP_SECONDS = metrics.histogram('aider_setup_seconds', 'Time to create a new Aider coder when none is idle')
+
+
+class CoderPool:
+    def __init__(self, max_size=4, idle_timeout=600):
+        # max_size bounds idle plus busy coders, idle coders are dropped after idle_timeout seconds
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._idle = {}  # key -> list of (coder, last_used)
+        self._busy = 0
+        self._condition = threading.Condition()
+        self.created = 0
+        self.reused = 0
+
+    def _idle_count(self):
+        return sum(len(coders) for coders in self._idle.values())
+
+    def _evict_expired(self):
+        now = time.time()
+        for key in list(self._idle):
+            self._idle[key] = [(coder, last_used) for coder, last_used in self._idle[key] if now - last_used < self.idle_timeout]
+            if not self._idle[key]:
+                del self._idle[key]
+
+    def _evict_oldest(self):
+        # Make room by dropping the least recently used idle coder of any key
+        oldest_key = min(self._idle, key=lambda key: self._idle[key][0][1])
+        self._idle[oldest_key].pop(0)
+        if not self._idle[oldest_key]:
+            del self._idle[oldest_key]
+
+    def _checkout(self, key):
+        with self._condition:
+            while True:
+                self._evict_expired()
+                if self._idle.get(key):
+                    coder, _ = self._idle[key].pop()
+                    self._busy += 1
+                    self.reused += 1
+                    return coder
+                if self._busy + self._idle_count() < self.max_size:
+                    self._busy += 1
+                    return None
+                if self._idle:
+                    self._evict_oldest()
+                    continue
+                # Every coder is busy, wait for one to come back
+                self._condition.wait()
+
+    @staticmethod
+    def reset(coder):
+        # Forget the previous request's conversation, files are re-read from disk on the next run
+        coder.done_messages = []
+        coder.cur_messages = []
+
+    @staticmethod
+    def use_notes(coder, notes_file):
+        # Coders are pooled by the full notes file, each run reads the notes selected for its own prompt
+        coder.abs_read_only_fnames = {os.path.abspath(notes_file)}
+
+    @contextmanager
+    def acquire(self, fname, notes_file, factory):
+        key = (os.path.abspath(fname), os.path.abspath(notes_file))
+        coder = self._checkout(key)
+        keep = False
+        try:
+            if coder is None:
+                with AIDER_SETUP_SECONDS.time():
+                    coder = factory()
+                self.created += 1
+            yield coder
+            keep = True
+        finally:
+            with self._condition:
+                self._busy -= 1
+                # A coder that failed mid-run may be in an odd state, do not reuse it
+                if keep:
+                    self.reset(coder)
+                    self._idle.setdefault(key, []).append((coder, time.time()))
+                self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'idle': self._idle_count(),
+                'busy': self._busy,
+                'created': self.created,
+                'reused': self.reused,
+            }
+
+
+# Shared by the extract and add runners
+coder_pool = CoderPool(max_size=int(os.getenv('AIDER_POOL_SIZE', 4)), idle_timeout=int(os.getenv('AIDER_POOL_IDLE_TIMEOUT', 600)))
@@ -0,0 +1,185 @@
+#Builds the message list sent to the chat API within a token budget. Recent turns are kept verbatim, large script and image payloads are truncated, and older turns are folded into a rolling summary.
+import math
+import threading
+
+try:
+    import tiktoken
+except ImportError:  # Fall back to a character based estimate
+    tiktoken = None
+
+# Message types holding bulky tool output, see DatabaseInterface.add_script_run and add_image_analysis
+PAYLOAD_TYPES = ('script_result', 'image_analysis')
+
+# Rough per-message overhead the chat format adds on top of the content
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Room left for the "[... N characters truncated ...]" marker TokenCounter.truncate inserts
+TRUNCATION_MARKER_TOKENS = 16
+
+
+# Encodings by model, looked up once per process since every conversation builds its own counter
+_encodings = {}
+
+
+def get_encoding(model):
+    if tiktoken is None:
+        return None
+    if model not in _encodings:
+        # tiktoken downloads its encodings on first use, estimate when that is not possible
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except Exception as e:
+            print(f"Token encoding for {model} unavailable, estimating token counts: {e}")
+            _encodings[model] = None
+    return _encodings[model]
+
+
+class TokenCounter:
+    def __init__(self, model="gpt-4"):
+        self.encoding = get_encoding(model)
+
+    def count(self, text):
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+        return math.ceil(len(text) / 4)
+
+    def count_message(self, message):
+        return self.count(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+    def truncate(self, text, max_tokens):
+        # Keep the head and tail of the text, they usually hold the useful part of script output
+        if self.count(text) <= max_tokens:
+            return text
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text)
+            head = self.encoding.decode(tokens[:max_tokens * 2 // 3])
+            tail = self.encoding.decode(tokens[-(max_tokens // 3):])
+        else:
+            head = text[:max_tokens * 4 * 2 // 3]
+            tail = text[-(max_tokens * 4 // 3):]
+        return f"{head}\n[... {len(text) - len(head) - len(tail)} characters truncated ...]\n{tail}"
+
+
+def extractive_summary(previous_summary, messages, counter, max_tokens):
+    # Summary without an LLM call: one short line per folded message, oldest lines dropped first
+    lines = previous_summary.splitlines() if previous_summary else []
+    for message in messages:
+        content = " ".join(message["content"].split())
+        if len(content) > 200:
+            content = content[:200] + "..."
+        lines.append(f"{message['role']}: {content}")
+    while len(lines) > 1 and counter.count("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+class ContextBuilder:
+    def __init__(self, max_tokens=6000, payload_tokens=500, summary_tokens=500, min_recent=4, summarizer=None, model="gpt-4", on_fold=None):
+        # max_tokens bounds the whole prompt, payload_tokens bounds each script or image result,
+        # summary_tokens bounds the rolling summary of folded turns.
+        # on_fold(summary, folded) is called after each fold so the summary can be persisted
+        self.max_tokens = max_tokens
+        self.payload_tokens = payload_tokens
+        self.summary_tokens = summary_tokens
+        self.min_recent = min_recent
+        self.summarizer = summarizer
+        self.on_fold = on_fold
+        self.counter = TokenCounter(model)
+        self.summary = ""
+        self.folded = 0  # Messages folded into the summary since the last reset
+        # Folds run one at a time so each builds on the previous summary, reset() bumps the
+        # generation so a fold that was in flight during a reset does not restore the old summary
+        self._fold_lock = threading.Lock()
+        self._generation = 0
+
+    def reset(self):
+        self._generation += 1
+        self.summary = ""
+        self.folded = 0
+
+    def restore(self, summary, folded):
+        # Summary of a conversation reloaded from storage, its folded messages carry the summarized flag
+        self.summary = summary
+        self.folded = folded
+
+    def compact(self, message):
+        content = message["content"]
+        if message.get("type") in PAYLOAD_TYPES:
+            content = self.counter.truncate(content, self.payload_tokens)
+        return {"role": message["role"], "content": content}
+
+    def fold(self, messages):
+        # Add messages to the rolling summary, each message is only ever summarized once.
+        # The summarizer may call the API, callers must not hold the conversation lock
+        with self._fold_lock:
+            messages = [message for message in messages if not message.get("summarized")]
+            if not messages:
+                return
+            generation = self._generation
+            compacted = [self.compact(message) for message in messages]
+            summary = None
+            if self.summarizer is not None:
+                try:
+                    summary = self.summarizer(self.summary, compacted, self.summary_tokens)
+                except Exception as e:
+                    print(f"Error summarizing conversation history: {e}")
+            if not summary:
+                summary = extractive_summary(self.summary, compacted, self.counter, self.summary_tokens)
+            if generation != self._generation:
+                return
+            self.summary = self.counter.truncate(summary, self.summary_tokens)
+            for message in messages:
+                message["summarized"] = True
+            self.folded += len(messages)
+            if self.on_fold:
+                self.on_fold(self.summary, self.folded)
+
+    def trim(self, messages, sizes, budget):
+        # The min_recent messages can exceed the budget on their own, cut the oldest of them
+        # down, or drop them, until the prompt fits. The newest message is only ever truncated
+        messages = list(messages)
+        excess = sum(sizes) - budget
+        for i, size in enumerate(sizes):
+            if excess <= 0:
+                break
+            room = size - excess - MESSAGE_OVERHEAD_TOKENS - TRUNCATION_MARKER_TOKENS
+            if room <= 0 and i < len(messages) - 1:
+                messages[i] = None
+                excess -= size
+                continue
+            content = self.counter.truncate(messages[i]["content"], max(room, 1))
+            messages[i] = {"role": messages[i]["role"], "content": content}
+            excess -= size - self.counter.count_message(messages[i])
+        return [message for message in messages if message is not None]
+
+    def build(self, history):
+        # history[0] is the system prompt, the rest is the conversation in order.
+        # Can fold older turns, so callers pass a copy of the history rather than holding its lock
+        system = {"role": history[0]["role"], "content": history[0]["content"]}
+        turns = [
+            message for message in history[1:]
+            if message["role"] in ["system", "user", "assistant"] and not message.get("summarized")
+        ]
+        compacted = [self.compact(message) for message in turns]
+        sizes = [self.counter.count_message(message) for message in compacted]
+
+        budget = self.max_tokens - self.counter.count_message(system) - self.summary_tokens - MESSAGE_OVERHEAD_TOKENS
+        if sum(sizes) > budget:
+            # Fold down to three quarters of the budget so folding, and the summarizer call, happens in batches
+            target = budget * 3 // 4
+            keep = 0
+            used = 0
+            for size in reversed(sizes):
+                if keep >= self.min_recent and used + size > target:
+                    break
+                used += size
+                keep += 1
+            self.fold(turns[:len(turns) - keep])
+            compacted = compacted[len(turns) - keep:]
+            if used > budget:
+                compacted = self.trim(compacted, sizes[len(sizes) - keep:], budget)
+
+        messages = [system]
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{self.summary}"})
+        return messages + compacted
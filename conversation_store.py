@@ -0,0 +1,126 @@
+#Keeps one conversation per browser session. Recently used sessions stay in memory, and every message and rolling summary is appended to SQLite so evicted sessions can be reloaded.
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class ConversationStore:
+    def __init__(self, db_path, factory, max_sessions=100, max_history=50, shared=False):
+        # factory(history, on_append) builds the per-session conversation object,
+        # at most max_sessions of them are kept in memory.
+        # With shared, other processes append to the same database and hot sessions are checked for their messages
+        self.db_path = db_path
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.max_history = max_history
+        self.shared = shared
+        self._sessions = OrderedDict()
+        self._last_ids = {}  # session id -> id of the last message the hot conversation has seen
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, role TEXT NOT NULL, "
+                "content TEXT NOT NULL, type TEXT, created REAL NOT NULL, covers INTEGER)"
+            )
+            # covers is how many messages since the last clear a 'summary' row summarizes
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(messages)")]
+            if 'covers' not in columns:
+                conn.execute("ALTER TABLE messages ADD COLUMN covers INTEGER")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def append(self, session_id, message):
+        # Append-only, clearing a conversation is recorded as a 'clear' marker
+        with self._write_lock, self._connect() as conn:
+            previous_id = self._max_id(conn, session_id) if self.shared else None
+            cursor = conn.execute(
+                "INSERT INTO messages (session_id, role, content, type, created, covers) VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, message["role"], message["content"], message.get("type"), time.time(), message.get("covers")),
+            )
+        if self.shared:
+            # Only our own message is marked as seen, one another worker wrote first still triggers a reload
+            with self._lock:
+                if self._last_ids.get(session_id) == previous_id:
+                    self._last_ids[session_id] = cursor.lastrowid
+
+    def _max_id(self, conn, session_id):
+        return conn.execute("SELECT MAX(id) FROM messages WHERE session_id = ?", (session_id,)).fetchone()[0] or 0
+
+    def last_id(self, session_id):
+        with self._connect() as conn:
+            return self._max_id(conn, session_id)
+
+    def load(self, session_id):
+        # Messages since the last clear, limited to what the conversation keeps in memory. The latest
+        # summary comes first, and the messages it covers are flagged as summarized like in the live conversation
+        with self._connect() as conn:
+            clear_id = conn.execute(
+                "SELECT MAX(id) FROM messages WHERE session_id = ? AND type = 'clear'", (session_id,)
+            ).fetchone()[0] or 0
+            summary = conn.execute(
+                "SELECT content, covers FROM messages WHERE session_id = ? AND id > ? AND type = 'summary' ORDER BY id DESC LIMIT 1",
+                (session_id, clear_id),
+            ).fetchone()
+            total = conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE session_id = ? AND id > ? AND type IS NOT 'summary'",
+                (session_id, clear_id),
+            ).fetchone()[0]
+            rows = conn.execute(
+                "SELECT role, content, type FROM messages WHERE session_id = ? AND id > ? AND type IS NOT 'summary' "
+                "ORDER BY id DESC LIMIT ?",
+                (session_id, clear_id, self.max_history),
+            ).fetchall()
+        messages = [{"role": role, "content": content, "type": message_type} for role, content, message_type in reversed(rows)]
+        if summary is None:
+            return messages
+        first_index = total - len(messages)
+        for index, message in enumerate(messages, start=first_index):
+            if index < summary[1]:
+                message["summarized"] = True
+        return [{"role": "system", "content": summary[0], "type": "summary", "covers": summary[1]}] + messages
+
+    def get(self, session_id):
+        # SQLite is read outside the store lock, so loading one session does not hold up the others
+        last_id = self.last_id(session_id) if self.shared else None
+        with self._lock:
+            conversation = self._sessions.get(session_id)
+            # A hot session another worker has appended to since is reloaded
+            if conversation is not None and last_id == self._last_ids.get(session_id):
+                self._sessions.move_to_end(session_id)
+                return conversation
+
+        conversation = self.factory(self.load(session_id), lambda message: self.append(session_id, message))
+        with self._lock:
+            # Another request may have loaded the session in the meantime, every caller gets the same one
+            current = self._sessions.get(session_id)
+            if current is not None and last_id == self._last_ids.get(session_id):
+                self._sessions.move_to_end(session_id)
+                return current
+            self._sessions[session_id] = conversation
+            self._sessions.move_to_end(session_id)
+            if self.shared:
+                self._last_ids[session_id] = last_id
+            # Cold sessions are only dropped from memory, their messages stay in SQLite
+            while len(self._sessions) > self.max_sessions:
+                evicted, _ = self._sessions.popitem(last=False)
+                self._last_ids.pop(evicted, None)
+            return conversation
+
+    def stats(self):
+        with self._lock:
+            return {'hot_sessions': len(self._sessions)}
@@ -1,57 +1,196 @@
-from openai import OpenAI
 import os
+import threading
+import time
 from dotenv import load_dotenv
+from context_builder import ContextBuilder
+from llm_client import client_from_env, record_usage
+import metrics
+
+LLM_SECONDS = metrics.histogram('llm_request_seconds', 'Duration of chat completion calls')
+LLM_FIRST_TOKEN_SECONDS = metrics.histogram('llm_first_token_seconds', 'Time until a streamed completion yields its first token')
 
 class DatabaseInterface:
-    def __init__(self):
-        # Initialize OpenAI client
+    def __init__(self, response_cache=None, workbook_version=None, client=None, history=None, on_append=None):
+        # response_cache is an optional ResponseCache, workbook_version returns the
+        # current spreadsheet version, e.g. WorkbookCache.stamp, so cached answers are dropped after a write.
+        # history restores a saved conversation and on_append(message) persists each new message
+        self.response_cache = response_cache
+        self.workbook_version = workbook_version
+        self.on_append = on_append
+        self._lock = threading.RLock()
+
+        # client is an LLMClient, sessions share one so calls are pooled, limited and coalesced
         load_dotenv()
-        self.client = OpenAI(api_key=os.getenv('AI_KEY'))
+        self.client = client or client_from_env()
+        # A saved conversation may start with its rolling summary, see ConversationStore.load
+        history = list(history or [])
+        summary = history.pop(0) if history and history[0].get("type") == "summary" else None
         self.conversation_history = [
             {"role": "system", "content": "You are a helpful assistant for a student attendance system."}
-        ]
+        ] + history
         self.max_history = 50  # Increased maximum number of messages to keep in history
+        # Prompt sent to the API is kept within this many tokens, older turns are summarized
+        self.context = ContextBuilder(
+            max_tokens=int(os.getenv('CONTEXT_MAX_TOKENS', 6000)),
+            payload_tokens=int(os.getenv('CONTEXT_PAYLOAD_TOKENS', 500)),
+            summarizer=self.summarize,
+            on_fold=self._record_summary,
+        )
+        if summary:
+            self.context.restore(summary["content"], summary["covers"])
 
-    def send_message(self, message, message_type="text"):
-        try:
-            # Add user message to conversation history
-            self.conversation_history.append({"role": "user", "content": message, "type": message_type})
-            
-            # Prepare the messages for the API call
-            api_messages = [
-                {"role": msg["role"], "content": msg["content"]}
-                for msg in self.conversation_history
-                if msg["role"] in ["system", "user", "assistant"]
-            ]
-
-            response = self.client.chat.completions.create(
-                model="gpt-4",  # Using GPT-4 model
-                messages=api_messages
-            )
+    def _record_summary(self, summary, folded):
+        # The summary is persisted with the messages but is not part of the history
+        if self.on_append:
+            self.on_append({"role": "system", "content": summary, "type": "summary", "covers": folded})
 
-            assistant_response = response.choices[0].message.content
+    def _append(self, *messages):
+        # Appends can come from several request and job threads at once
+        with self._lock:
+            for message in messages:
+                self.conversation_history.append(message)
+                if self.on_append:
+                    self.on_append(message)
 
-            # Add assistant's response to conversation history
-            self.conversation_history.append({"role": "assistant", "content": assistant_response, "type": "text"})
+    def _prepare_messages(self, user_message):
+        # The user message joins the history only with its answer, see _record_response
+        with self._lock:
+            history = self.conversation_history + [user_message]
+        # Prepare the messages for the API call within the token budget, outside the lock
+        # since folding older turns can call the summarizer
+        return self.context.build(history)
+
+    def _record_response(self, user_message, assistant_response):
+        with self._lock:
+            # Add the user message and the assistant's response to conversation history together,
+            # so an exchange that failed or was abandoned mid-stream leaves no unanswered message
+            self._append(user_message, {"role": "assistant", "content": assistant_response, "type": "text"})
 
             # Trim conversation history if it exceeds max_history
+            overflow = []
             if len(self.conversation_history) > self.max_history + 1:  # +1 for the system message
-                self.conversation_history = self.conversation_history[:1] + self.conversation_history[-(self.max_history):]
+                overflow = self.conversation_history[1:-(self.max_history)]
+        if not overflow:
+            return
+        # Keep what the dropped messages said in the rolling summary, then drop exactly those
+        # messages, anything appended during the summarizer call is trimmed next time
+        self.context.fold(overflow)
+        dropped = set(map(id, overflow))
+        with self._lock:
+            self.conversation_history = [message for message in self.conversation_history if id(message) not in dropped]
+
+    def summarize(self, previous_summary, messages, max_tokens):
+        # Fold messages into the running summary with a small model, only new messages are sent
+        transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+        with LLM_SECONDS.time(operation='summarize', model='gpt-4o-mini'):
+            response = self.client.complete(
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": "Update the summary of a conversation with a student attendance assistant. Keep names, dates, numbers and decisions. Reply with the summary only."},
+                    {"role": "user", "content": f"Current summary:\n{previous_summary or '(empty)'}\n\nNew messages:\n{transcript}"},
+                ],
+                max_tokens=max_tokens
+            )
+        record_usage("gpt-4o-mini", response.usage)
+        return response.choices[0].message.content
+
+    def _cache_lookup(self, message):
+        # Returns (key, version, cached_response), key is None when caching is off
+        if self.response_cache is None:
+            return None, None, None
+        version = self.workbook_version() if self.workbook_version else None
+        with self._lock:
+            key = self.response_cache.make_key(message, self.conversation_history)
+        return key, version, self.response_cache.get(key, version)
+
+    def _record_cached(self, message, message_type, response):
+        # Keep the history identical to an uncached exchange
+        self._record_response({"role": "user", "content": message, "type": message_type}, response)
+
+    def send_message(self, message, message_type="text"):
+        try:
+            key, version, cached = self._cache_lookup(message)
+            if cached is not None:
+                self._record_cached(message, message_type, cached)
+                return cached
+
+            user_message = {"role": "user", "content": message, "type": message_type}
+            api_messages = self._prepare_messages(user_message)
+
+            with LLM_SECONDS.time(operation='send', model='gpt-4'):
+                response = self.client.complete(
+                    model="gpt-4",  # Using GPT-4 model
+                    messages=api_messages
+                )
+            record_usage("gpt-4", response.usage)
+
+            assistant_response = response.choices[0].message.content
+            self._record_response(user_message, assistant_response)
+            if key is not None:
+                self.response_cache.put(key, version, assistant_response)
 
             return assistant_response
         except Exception as e:
             print(f"Error in sending message to OpenAI: {e}")
             return "I'm sorry, I couldn't process your request at the moment."
 
+    def stream_message(self, message, message_type="text"):
+        # Yields the assistant's answer chunk by chunk as the API produces it,
+        # the question and full answer are added to the history once the stream completes
+        stream = None
+        try:
+            key, version, cached = self._cache_lookup(message)
+            if cached is not None:
+                self._record_cached(message, message_type, cached)
+                yield cached
+                return
+
+            user_message = {"role": "user", "content": message, "type": message_type}
+            api_messages = self._prepare_messages(user_message)
+
+            start = time.perf_counter()
+            stream = self.client.stream(
+                model="gpt-4",  # Using GPT-4 model
+                messages=api_messages,
+                stream_options={"include_usage": True}
+            )
+
+            chunks = []
+            for chunk in stream:
+                # The usage chunk comes last and has no choices
+                if getattr(chunk, 'usage', None) is not None:
+                    record_usage("gpt-4", chunk.usage)
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content
+                if token:
+                    if not chunks:
+                        LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start, model='gpt-4')
+                    chunks.append(token)
+                    yield token
+            LLM_SECONDS.observe(time.perf_counter() - start, operation='stream', model='gpt-4')
+
+            assistant_response = "".join(chunks)
+            self._record_response(user_message, assistant_response)
+            if key is not None:
+                self.response_cache.put(key, version, assistant_response)
+        except Exception as e:
+            print(f"Error in streaming message from OpenAI: {e}")
+            yield "I'm sorry, I couldn't process your request at the moment."
+        finally:
+            # Stop reading from the API if the client went away mid-stream
+            if stream is not None:
+                stream.close()
+
     def add_image_analysis(self, image_description, analysis_result):
         # Add image analysis to conversation history
-        self.conversation_history.append({"role": "user", "content": f"Analyzed image: {image_description}", "type": "image"})
-        self.conversation_history.append({"role": "assistant", "content": f"Image analysis result: {analysis_result}", "type": "image_analysis"})
+        self._append({"role": "user", "content": f"Analyzed image: {image_description}", "type": "image"},
+                     {"role": "assistant", "content": f"Image analysis result: {analysis_result}", "type": "image_analysis"})
 
     def add_script_run(self, script_name, script_result):
         # Add script run to conversation history
-        self.conversation_history.append({"role": "user", "content": f"Ran script: {script_name}", "type": "script"})
-        self.conversation_history.append({"role": "assistant", "content": f"Script result: {script_result}", "type": "script_result"})
+        self._append({"role": "user", "content": f"Ran script: {script_name}", "type": "script"},
+                     {"role": "assistant", "content": f"Script result: {script_result}", "type": "script_result"})
 
     def save_data(self):
         # Implement data saving logic
@@ -59,4 +198,8 @@ class DatabaseInterface:
 
     def clear_history(self):
         # Clear conversation history except for the initial system message
-        self.conversation_history = self.conversation_history[:1]
+        with self._lock:
+            self.conversation_history = self.conversation_history[:1]
+            self.context.reset()
+            if self.on_append:
+                self.on_append({"role": "system", "content": "", "type": "clear"})
@@ -1,42 +1,283 @@
-import openpyxl
 import os
+import sys
+import json
+import hashlib
+import time
+import datetime
+from concurrent.futures import ProcessPoolExecutor
 
-def analyze_excel(file_path, output_file):
-    # Load the workbook
-    wb = openpyxl.load_workbook(file_path, data_only=True)
+from workbook_cache import file_hash
 
+# Sheet schemas and profiles are remembered here so an unchanged workbook is not read again
+SCHEMA_CACHE_FILE = os.path.join('cache', 'excel_schema_cache.json')
+
+def get_column_names(sheet):
+    # Column names are assumed to be in the first row
+    return [cell.value for cell in sheet[1]]
+
+def read_sheet_schema(sheet, sample_rows=2):
+    # Only the header row and the sample rows are read, which keeps read_only sheets streaming
+    rows = sheet.iter_rows(min_row=1, max_row=1 + sample_rows, values_only=True)
+    column_names = next(rows, ())
+    samples = [f"{row}" for row in rows]
+    # read_only sheets stop at the last populated row, pad like a fully loaded sheet would
+    while len(samples) < sample_rows:
+        samples.append(f"{tuple(None for _ in column_names)}")
+    return {
+        'columns': [f"{col_name}" for col_name in column_names],
+        'samples': samples,
+    }
+
+def value_type(value):
+    # bool is checked first because it is a subclass of int
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, int):
+        return 'integer'
+    if isinstance(value, float):
+        return 'number'
+    if isinstance(value, datetime.datetime):
+        return 'datetime'
+    if isinstance(value, datetime.date):
+        return 'date'
+    if isinstance(value, datetime.time):
+        return 'time'
+    return 'text'
+
+def new_column_stats():
+    return {'nulls': 0, 'types': {}, 'ranges': {}, 'distinct': set(), 'examples': []}
+
+def update_column_stats(stats, value, max_examples=3, max_distinct=10000):
+    if value is None or (isinstance(value, str) and not value.strip()):
+        stats['nulls'] += 1
+        return
+    if isinstance(value, str):
+        value = value.strip()
+
+    type_name = value_type(value)
+    stats['types'][type_name] = stats['types'].get(type_name, 0) + 1
+
+    # Ranges are kept per type since mixed types cannot be compared
+    value_range = stats['ranges'].get(type_name)
+    if value_range is None:
+        stats['ranges'][type_name] = [value, value]
+    elif value < value_range[0]:
+        value_range[0] = value
+    elif value > value_range[1]:
+        value_range[1] = value
+
+    # Stop tracking distinct values once a column is clearly high-cardinality
+    if stats['distinct'] is not None:
+        stats['distinct'].add(value)
+        if len(stats['distinct']) > max_distinct:
+            stats['distinct'] = None
+    if len(stats['examples']) < max_examples and value not in stats['examples']:
+        stats['examples'].append(value)
+
+def format_column_profile(col_name, stats, row_count, max_distinct=10000):
+    non_null = row_count - stats['nulls']
+    if not stats['types']:
+        return f"- {col_name}: empty"
+
+    # The most common type decides the reported type and range
+    types = sorted(stats['types'], key=stats['types'].get, reverse=True)
+    type_label = types[0] if len(types) == 1 else f"mixed ({', '.join(types)})"
+    null_ratio = stats['nulls'] / row_count if row_count else 0
+
+    if stats['distinct'] is None:
+        cardinality = f">{max_distinct} distinct"
+    else:
+        cardinality = f"{len(stats['distinct'])} distinct"
+        if len(stats['distinct']) == non_null and non_null > 1:
+            cardinality += " (unique)"
+
+    low, high = stats['ranges'][types[0]]
+    examples = ", ".join(repr(example) for example in stats['examples'])
+    return f"- {col_name}: {type_label}, {null_ratio:.0%} null, {cardinality}, min {low!r}, max {high!r}, e.g. {examples}"
+
+def profile_sheet(file_path, sheet_name, sample_rows=2):
+    # Runs in a worker process: reads one whole sheet in read_only mode, profiles every column and hashes
+    # the rows in the same pass for the sheet's key
+    import openpyxl
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = wb[sheet_name]
+        schema = read_sheet_schema(sheet, sample_rows)
+        stats = [new_column_stats() for _ in schema['columns']]
+
+        digest = hashlib.sha256(str(sheet.title).encode('utf-8'))
+        rows = hashed_rows(digest, sheet.iter_rows(values_only=True))
+        next(rows, None)  # The header row is part of the key but not of the profile
+        row_count = 0
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            row_count += 1
+            for column_stats, value in zip(stats, row):
+                update_column_stats(column_stats, value)
+
+        schema['rows'] = row_count
+        schema['key'] = digest.hexdigest()
+        schema['profile'] = [
+            format_column_profile(col_name, column_stats, row_count)
+            for col_name, column_stats in zip(schema['columns'], stats)
+        ]
+        return schema
+    finally:
+        wb.close()
+
+def profile_sheets(file_path, sheet_names, workers=None):
+    # Fan sheets out across a process pool, a single sheet is profiled in-process
+    if len(sheet_names) <= 1 or workers == 1:
+        return {sheet_name: profile_sheet(file_path, sheet_name) for sheet_name in sheet_names}
+
+    workers = min(workers or os.cpu_count() or 1, len(sheet_names))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(profile_sheet, [file_path] * len(sheet_names), sheet_names)
+        return dict(zip(sheet_names, results))
+
+def hashed_rows(digest, rows):
+    # Yields rows unchanged while adding the sheet's own cell values to digest, so an edit elsewhere in the
+    # workbook (another sheet, a shared string only it uses) leaves the sheet's key unchanged. Trailing
+    # blank cells and rows are left out, read_only and normal worksheets pad rows differently
+    blank_rows = 0
+    for row in rows:
+        values = list(row)
+        while values and values[-1] is None:
+            values.pop()
+        if not values:
+            blank_rows += 1
+        else:
+            digest.update(f"{blank_rows}:{values!r}\n".encode('utf-8'))
+            blank_rows = 0
+        yield row
+
+def sample_key(sheet, schema):
+    # Cheap key for the notes without a profile: the sheet's dimensions plus the header and sample rows
+    # already read for its schema, so no other rows are read
+    digest = hashlib.sha256(repr((sheet.title, sheet.max_row, sheet.max_column)).encode('utf-8'))
+    digest.update(repr((schema['columns'], schema['samples'])).encode('utf-8'))
+    return digest.hexdigest()
+
+def load_schema_cache(cache_file):
+    try:
+        with open(cache_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_schema_cache(cache_file, schema_cache):
+    os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+    temp_file = f"{cache_file}.tmp"
+    with open(temp_file, 'w') as f:
+        json.dump(schema_cache, f)
+    os.replace(temp_file, cache_file)
+
+def write_notes(file_path, output_file, sheet_names, schemas):
     with open(output_file, 'w') as f:
         # Write the name of the Excel file
         f.write(f"Excel File Name: {os.path.basename(file_path)}\n")
 
         # Write the number of sheets
-        f.write(f"Number of Sheets: {len(wb.sheetnames)}\n")
+        f.write(f"Number of Sheets: {len(sheet_names)}\n")
 
         # Write the names of the sheets
         f.write("Sheet Names:\n")
-        for sheet_name in wb.sheetnames:
+        for sheet_name in sheet_names:
             f.write(f"- {sheet_name}\n")
 
         # Analyze each sheet
-        for sheet_name in wb.sheetnames:
-            sheet = wb[sheet_name]
+        for sheet_name in sheet_names:
+            schema = schemas[sheet_name]
             f.write(f"\nAnalyzing Sheet: {sheet_name}\n")
 
-            # Get column names (assuming first row contains headers)
-            column_names = [cell.value for cell in sheet[1]]
             f.write("Column Names:\n")
-            for col_name in column_names:
+            for col_name in schema['columns']:
                 f.write(f"- {col_name}\n")
 
             # Write sample of first two rows after column names
             f.write("\nSample Data (First Two Rows):\n")
-            for row in sheet.iter_rows(min_row=2, max_row=3, values_only=True):
+            for row in schema['samples']:
                 f.write(f"{row}\n")
 
-    wb.close()
-    print(f"Analysis complete. Results saved to {output_file}")
+            # Column statistics from profiling mode
+            if 'profile' in schema:
+                f.write(f"\nColumn Profile ({schema['rows']} data rows, columns marked (unique) can be used as lookup keys):\n")
+                for line in schema['profile']:
+                    f.write(f"{line}\n")
+
+def analyze_excel(file_path, output_file, cache=None, schema_cache_file=SCHEMA_CACHE_FILE, profile=False, workers=None):
+    start = time.time()
+    stat = os.stat(file_path)
+    schema_cache = load_schema_cache(schema_cache_file) if schema_cache_file else {}
+
+    # Skip hashing when the file is untouched since the last run
+    if schema_cache.get('mtime') == stat.st_mtime_ns and schema_cache.get('size') == stat.st_size:
+        workbook_hash = schema_cache.get('workbook_hash')
+    else:
+        workbook_hash = cache.version(file_path) if cache is not None else file_hash(file_path)
+
+    notes_current = (
+        schema_cache.get('workbook_hash') == workbook_hash
+        and schema_cache.get('profile', False) == profile
+        and schema_cache.get('output_file') == os.path.abspath(output_file)
+        and os.path.exists(output_file)
+    )
+    if notes_current:
+        if schema_cache.get('mtime') != stat.st_mtime_ns:
+            save_schema_cache(schema_cache_file, dict(schema_cache, mtime=stat.st_mtime_ns, size=stat.st_size))
+        print(f"Workbook unchanged, {output_file} is up to date ({time.time() - start:.3f}s)")
+        return
+
+    # Load the workbook, reusing the parsed copy held by a WorkbookCache when one is given,
+    # otherwise stream it in read_only mode so only the sample rows are parsed
+    if cache is not None:
+        wb = cache.get(file_path)
+    else:
+        import openpyxl  # Imported here, the app only needs get_column_names from this module
+        wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+
+    try:
+        cached_sheets = schema_cache.get('sheets', {})
+        schemas = {}
+        changed = []
+        if profile:
+            # Each worker reads its sheet once and returns the profile with the key of the rows it read
+            schemas = profile_sheets(file_path, wb.sheetnames, workers)
+            changed = [sheet_name for sheet_name in wb.sheetnames
+                       if cached_sheets.get(sheet_name, {}).get('key') != schemas[sheet_name]['key']]
+        else:
+            # Reading stops after the sample rows, the key only covers what was read
+            for sheet_name in wb.sheetnames:
+                sheet = wb[sheet_name]
+                schema = read_sheet_schema(sheet)
+                schema['key'] = sample_key(sheet, schema)
+                if cached_sheets.get(sheet_name, {}).get('key') != schema['key']:
+                    changed.append(sheet_name)
+                schemas[sheet_name] = schema
+
+        write_notes(file_path, output_file, wb.sheetnames, schemas)
+    finally:
+        if cache is None:
+            wb.close()
+
+    if schema_cache_file:
+        save_schema_cache(schema_cache_file, {
+            'workbook_hash': workbook_hash,
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'output_file': os.path.abspath(output_file),
+            'profile': profile,
+            'sheets': schemas,
+        })
+    if profile:
+        print(f"Analysis complete. Profiled {len(schemas)} sheets, {len(changed)} changed. Results saved to {output_file}")
+    else:
+        print(f"Analysis complete. Read the schema of {len(schemas)} sheets, {len(changed)} changed. Results saved to {output_file}")
 
 # Example usage
-file_path = "studio_database_1.xlsx"
-output_file = "excel_notes_2.txt"
-analyze_excel(file_path, output_file)
+if __name__ == "__main__":
+    file_path = "studio_database_1.xlsx"
+    output_file = "excel_notes_2.txt"
+    # Pass --profile to add per-column statistics, profiled in parallel across sheets
+    analyze_excel(file_path, output_file, profile='--profile' in sys.argv)
@@ -0,0 +1,156 @@
+#Watches the app directory for file changes and hands them to listeners. Uses inotify through watchdog when it is installed and falls back to polling. Also keeps the cached list of runnable scripts up to date.
+import ast
+import os
+import threading
+import time
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # Fall back to polling the directory
+    Observer = None
+    FileSystemEventHandler = object
+
+
+class _EventHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.watcher.dispatch('created', event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.watcher.dispatch('modified', event.src_path)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.watcher.dispatch('deleted', event.src_path)
+
+    def on_moved(self, event):
+        # Atomic saves show up as a rename onto the target file
+        if not event.is_directory:
+            self.watcher.dispatch('deleted', event.src_path)
+            self.watcher.dispatch('created', event.dest_path)
+
+
+class FileWatcher:
+    def __init__(self, directory, poll_interval=1.0):
+        # Only files directly inside directory are watched, subfolders like cache/ are ignored
+        self.directory = os.path.abspath(directory)
+        self.poll_interval = poll_interval
+        self._listeners = []
+        self._stop = threading.Event()
+        self._observer = None
+        self.mode = None
+
+    def subscribe(self, listener):
+        # listener(kind, name) with kind in created, modified, deleted and name relative to directory
+        self._listeners.append(listener)
+
+    def dispatch(self, kind, path):
+        path = os.path.abspath(path)
+        if os.path.dirname(path) != self.directory:
+            return
+        name = os.path.basename(path)
+        for listener in self._listeners:
+            try:
+                listener(kind, name)
+            except Exception as e:
+                print(f"Error handling file change {kind} {name}: {e}")
+
+    def _snapshot(self):
+        snapshot = {}
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                stat = entry.stat()
+                snapshot[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def _poll(self, previous):
+        while not self._stop.wait(self.poll_interval):
+            current = self._snapshot()
+            for name in current.keys() - previous.keys():
+                self.dispatch('created', os.path.join(self.directory, name))
+            for name in previous.keys() - current.keys():
+                self.dispatch('deleted', os.path.join(self.directory, name))
+            for name in current.keys() & previous.keys():
+                if current[name] != previous[name]:
+                    self.dispatch('modified', os.path.join(self.directory, name))
+            previous = current
+
+    def start(self):
+        if Observer is not None:
+            try:
+                self._observer = Observer()
+                self._observer.schedule(_EventHandler(self), self.directory, recursive=False)
+                self._observer.start()
+                self.mode = 'inotify'
+                return
+            except Exception as e:
+                print(f"Native file watching unavailable, polling instead: {e}")
+                self._observer = None
+        self.mode = 'polling'
+        threading.Thread(target=self._poll, args=(self._snapshot(),), daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+
+
+def local_imports(entry, directory):
+    # File names of the modules in directory that entry imports, directly or through each other,
+    # including imports made inside functions
+    found = set()
+    pending = [os.path.basename(entry)]
+    while pending:
+        name = pending.pop()
+        if name in found:
+            continue
+        found.add(name)
+        try:
+            with open(os.path.join(directory, name)) as f:
+                tree = ast.parse(f.read())
+        except (OSError, SyntaxError):
+            continue
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and not node.level:
+                modules = [node.module]
+            else:
+                continue
+            for module in modules:
+                file_name = module.split('.')[0] + '.py'
+                if os.path.isfile(os.path.join(directory, file_name)):
+                    pending.append(file_name)
+    return found
+
+
+class ScriptCatalog:
+    def __init__(self, directory, excluded):
+        # The listing is read once, then kept current from watcher events
+        self.directory = directory
+        self.excluded = set(excluded)
+        self._lock = threading.Lock()
+        self._scripts = {name for name in os.listdir(directory) if self._is_script(name)}
+        self.updated = time.time()
+
+    def _is_script(self, name):
+        return name.endswith('.py') and name not in self.excluded
+
+    def on_change(self, kind, name):
+        if not self._is_script(name):
+            return
+        with self._lock:
+            if kind == 'deleted':
+                self._scripts.discard(name)
+            elif os.path.isfile(os.path.join(self.directory, name)):
+                self._scripts.add(name)
+            self.updated = time.time()
+
+    def scripts(self):
+        with self._lock:
+            return sorted(self._scripts)
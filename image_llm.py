@@ -1,60 +1,114 @@
 import base64
-import requests
+import io
+import mimetypes
 from dotenv import load_dotenv
-import os
+from transcription_cache import image_hash
+from llm_client import client_from_env, record_usage
+import metrics
+
+IMAGE_ENCODE_SECONDS = metrics.histogram('image_encode_seconds', 'Time to downscale and base64 encode an image')
+IMAGE_TRANSCRIBE_SECONDS = metrics.histogram('image_transcribe_seconds', 'Duration of the transcription API call')
+IMAGE_TRANSCRIPTIONS = metrics.counter('image_transcriptions_total', 'Transcription requests by outcome')
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Without Pillow images are uploaded as-is
+    Image = None
 
 class ImageLLM:
-    def __init__(self, image_path):
-        load_dotenv()
-        self.api_key = os.getenv('AI_KEY')
-        self.headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
+    def __init__(self, image_path, cache=None, max_dimension=1568, quality=85, client=None, timeout=60):
+        # cache is an optional TranscriptionCache, images are downscaled so their longest
+        # side is at most max_dimension pixels and re-encoded as JPEG at the given quality.
+        # client is the app's shared LLMClient, one is created from the environment otherwise
+        self.cache = cache
+        if client is None:
+            load_dotenv()
+            client = client_from_env()
+        self.client = client
+        self.timeout = timeout
+        self.max_dimension = max_dimension
+        self.quality = quality
         self.image_path = image_path
 
-    def encode_image(self):
-        with open(self.image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+    def preprocess_image(self, image_bytes):
+        # Returns (image_bytes, mime_type), keeping the original when re-encoding does not make it smaller
+        mime_type = mimetypes.guess_type(self.image_path)[0] or "image/jpeg"
+        if Image is None:
+            return image_bytes, mime_type
+        try:
+            with Image.open(io.BytesIO(image_bytes)) as image:
+                image = ImageOps.exif_transpose(image)
+                image.thumbnail((self.max_dimension, self.max_dimension))
+                buffer = io.BytesIO()
+                image.convert("RGB").save(buffer, format="JPEG", quality=self.quality, optimize=True)
+        except Exception as e:
+            print(f"Could not preprocess image {self.image_path}: {e}")
+            return image_bytes, mime_type
+        if buffer.tell() >= len(image_bytes):
+            return image_bytes, mime_type
+        return buffer.getvalue(), "image/jpeg"
+
+    def encode_image(self, image_bytes=None):
+        if image_bytes is None:
+            with open(self.image_path, "rb") as image_file:
+                image_bytes = image_file.read()
+        image_bytes, mime_type = self.preprocess_image(image_bytes)
+        return base64.b64encode(image_bytes).decode('utf-8'), mime_type
 
     def transcribe_image(self):
-        base64_image = self.encode_image()
+        with open(self.image_path, "rb") as image_file:
+            image_bytes = image_file.read()
+
+        # The same image was transcribed before, skip the API call
+        cache_key = image_hash(image_bytes)
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                IMAGE_TRANSCRIPTIONS.inc(outcome='cached')
+                return cached
+
+        with IMAGE_ENCODE_SECONDS.time():
+            base64_image, mime_type = self.encode_image(image_bytes)
         
-        payload = {
-            "model": "gpt-4o-mini",  # Updated model name
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Transcribe this:"
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
+        model = "gpt-4o-mini"  # Updated model name
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": "Transcribe this:"
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{mime_type};base64,{base64_image}"
                         }
-                    ]
-                }
-            ],
-            "max_tokens": 300
-        }
+                    }
+                ]
+            }
+        ]
 
-        response = requests.post("https://api.openai.com/v1/chat/completions", headers=self.headers, json=payload)
-        message = response.json()
-        
-        if response.status_code != 200:
-            print(f"Error: API request failed with status code {response.status_code}")
-            print(f"Response: {message}")
+        import openai  # Already loaded by the client's first call, not at app startup
+        try:
+            with IMAGE_TRANSCRIBE_SECONDS.time(model=model):
+                response = self.client.complete(model=model, messages=messages, max_tokens=300, timeout=self.timeout)
+        except openai.APIError as e:
+            IMAGE_TRANSCRIPTIONS.inc(outcome='error')
+            print(f"Error: API request failed: {e}")
             return None
         
-        if 'choices' not in message:
-            print(f"Error: Unexpected response format. Full response: {message}")
+        if not response.choices:
+            IMAGE_TRANSCRIPTIONS.inc(outcome='error')
+            print(f"Error: Unexpected response format. Full response: {response}")
             return None
         
-        return message['choices'][0]['message']['content']
+        record_usage(model, response.usage)
+        IMAGE_TRANSCRIPTIONS.inc(outcome='api')
+        transcription = response.choices[0].message.content
+        if self.cache is not None:
+            self.cache.put(cache_key, transcription)
+        return transcription
 
 def main():
     image_path = "WIN_20241011_10_46_46_Pro.jpg"
@@ -0,0 +1,119 @@
+#Runs slow work such as Aider script generation on a bounded pool of background workers. Callers get a job id right away and poll for the status and result.
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    def __init__(self, kind, description):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.description = description
+        self.status = 'pending'
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.last_polled = self.created
+        self.future = None
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'description': self.description,
+            'status': self.status,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'error': self.error,
+        }
+
+
+class JobQueue:
+    def __init__(self, max_workers=2, abandon_timeout=120, result_ttl=3600, on_change=None):
+        # Pending jobs nobody polled for abandon_timeout seconds are cancelled, finished jobs are
+        # forgotten after result_ttl seconds. Only pending jobs can be cancelled: a running job edits
+        # scripts and the workbook, so it always runs to completion and keeps its result.
+        # on_change(job) is called on every status change, e.g. to share job state between workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self.abandon_timeout = abandon_timeout
+        self.result_ttl = result_ttl
+        self.on_change = on_change
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, description, func, on_complete=None):
+        # func(job) does the work, on_complete(job) runs afterwards unless the job was cancelled
+        self._prune()
+        job = Job(kind, description)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._changed(job)
+        job.future = self.executor.submit(self._run, job, func, on_complete)
+        return job
+
+    def _run(self, job, func, on_complete):
+        # Status changes happen under the lock so a cancel cannot race the job starting
+        with self._lock:
+            if job.status != 'pending':
+                return
+            job.status = 'running'
+            job.started = time.time()
+        self._changed(job)
+        try:
+            job.result = func(job)
+            if on_complete:
+                on_complete(job)
+            status, error = 'done', None
+        except Exception as e:
+            status, error = 'failed', str(e)
+        with self._lock:
+            job.status, job.error, job.finished = status, error, time.time()
+        self._changed(job)
+
+    def get(self, job_id):
+        # Looking a job up counts as the client still waiting for it
+        self._prune()
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job:
+            job.last_polled = time.time()
+        return job
+
+    def cancel(self, job_id):
+        # Only a pending job is cancelled, a running or finished one is returned unchanged
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != 'pending':
+                return job
+            job.status = 'cancelled'
+            job.finished = time.time()
+        if job.future:
+            job.future.cancel()
+        self._changed(job)
+        return job
+
+    def _changed(self, job):
+        if self.on_change:
+            try:
+                self.on_change(job)
+            except Exception as e:
+                print(f"Error recording job {job.id}: {e}")
+
+    def _prune(self):
+        now = time.time()
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            if job.status == 'pending' and now - job.last_polled > self.abandon_timeout:
+                self.cancel(job.id)
+            elif job.finished and now - job.finished > self.result_ttl:
+                with self._lock:
+                    self._jobs.pop(job.id, None)
+
+    def depth(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status in ('pending', 'running'))
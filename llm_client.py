@@ -0,0 +1,167 @@
+#Shared client for chat completion calls. All callers go through one pooled keep-alive connection pool and a concurrency limit, throttled and failed calls are retried with jittered exponential backoff, and identical requests already in flight share one call.
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+
+LLM_RETRIES = metrics.counter('llm_retries_total', 'Chat completion attempts retried, by reason')
+LLM_COALESCED = metrics.counter('llm_coalesced_total', 'Chat completion requests answered by an identical call already in flight')
+LLM_LIMIT_WAIT_SECONDS = metrics.histogram('llm_limit_wait_seconds', 'Time spent waiting for a free slot under the concurrency limit')
+LLM_TOKENS = metrics.counter('llm_tokens_total', 'Tokens used by chat completion calls, as reported by the API')
+
+
+def request_key(params):
+    # Requests with the same model, messages and options are identical
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def record_usage(model, usage):
+    # usage is the API's usage object, missing when a stream did not include it
+    if usage is not None:
+        LLM_TOKENS.inc(usage.prompt_tokens, model=model, kind='prompt')
+        LLM_TOKENS.inc(usage.completion_tokens, model=model, kind='completion')
+
+
+def retry_after(error):
+    # Seconds the server asked us to wait, None when it did not say
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMClient:
+    def __init__(self, api_key=None, base_url=None, max_concurrency=8, max_retries=4,
+                 backoff_base=0.5, backoff_max=20.0, timeout=60.0, pool_size=None):
+        # base_url defaults to OPENAI_BASE_URL like the openai package. pool_size defaults to max_concurrency,
+        # the SDK's own retries are off so every attempt goes through the limiter and backoff here
+        self.api_key = api_key
+        self.base_url = base_url
+        self.pool_size = pool_size or max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._client = None  # Built on first use, see _openai
+        self._retryable = ()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._in_flight = {}  # request key -> Future of the call every identical request waits on
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+        self.retries = 0
+
+    def _backoff(self, attempt, error):
+        # Full jitter, so a burst of throttled callers does not retry in lockstep
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        server_delay = retry_after(error)
+        if server_delay is not None:
+            delay = max(delay, min(server_delay, self.backoff_max))
+        return delay
+
+    def _openai(self):
+        # The openai package takes most of a second to import, so it is loaded on the first call
+        # (or by warm_up) instead of when the app starts
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import httpx
+                    import openai
+                    http = httpx.Client(
+                        limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                        timeout=httpx.Timeout(self.timeout, connect=10.0),
+                    )
+                    # Worth retrying: throttling, server errors, timeouts and dropped connections
+                    self._retryable = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+                    self._client = openai.OpenAI(api_key=self.api_key, base_url=self.base_url, http_client=http, max_retries=0)
+        return self._client
+
+    def warm_up(self):
+        self._openai()
+
+    def _create(self, **params):
+        with self._lock:
+            self.calls += 1
+        return self._openai().chat.completions.create(**params)
+
+    def _with_retries(self, params, hold_slot=False):
+        # With hold_slot the caller releases the slot itself, streams keep it until they are read
+        self._openai()
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            self._slots.acquire()
+            LLM_LIMIT_WAIT_SECONDS.observe(time.perf_counter() - start)
+            try:
+                result = self._create(**params)
+            except self._retryable as e:
+                self._slots.release()
+                if attempt >= self.max_retries:
+                    raise
+                error = e
+            except BaseException:
+                self._slots.release()
+                raise
+            else:
+                if not hold_slot:
+                    self._slots.release()
+                return result
+            # Back off outside the limiter so other requests can use the slot meanwhile
+            LLM_RETRIES.inc(reason=getattr(error, 'status_code', None) or type(error).__name__)
+            with self._lock:
+                self.retries += 1
+            time.sleep(self._backoff(attempt, error))
+            attempt += 1
+
+    def complete(self, **params):
+        # Same arguments as client.chat.completions.create, without stream
+        key = request_key(params)
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            LLM_COALESCED.inc(model=params.get('model'))
+            return future.result()
+
+        try:
+            future.set_result(self._with_retries(params))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return future.result()
+
+    def stream(self, **params):
+        # Streams are not shared between callers, only opening one is limited and retried.
+        # The slot is held until the stream is read to the end or closed
+        stream = self._with_retries(dict(params, stream=True), hold_slot=True)
+        try:
+            yield from stream
+        finally:
+            stream.close()
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'coalesced': self.coalesced, 'retries': self.retries, 'in_flight': len(self._in_flight)}
+
+
+def client_from_env():
+    # Client configured from the LLM_* environment variables, shared by the whole app
+    return LLMClient(api_key=os.getenv('AI_KEY'),
+                     max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', 8)),
+                     max_retries=int(os.getenv('LLM_MAX_RETRIES', 4)),
+                     timeout=float(os.getenv('LLM_TIMEOUT', 60)))
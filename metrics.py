@@ -0,0 +1,193 @@
+#Counters, gauges and duration histograms for each stage of request handling, rendered in the Prometheus text format for the /metrics endpoint. Stages timed inside a traced request are also collected per trace id.
+import contextvars
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# The trace of the request being handled by this thread, None when the request is not traced
+_current_trace = contextvars.ContextVar('trace', default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key):
+    if not key:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in key) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._functions = {}
+        self._lock = threading.Lock()
+
+    def set_function(self, function, **labels):
+        # The value is read from function() each time metrics are rendered, e.g. a queue's depth
+        with self._lock:
+            self._functions[_label_key(labels)] = function
+
+    def samples(self):
+        with self._lock:
+            functions = list(self._functions.items())
+        samples = []
+        for key, function in functions:
+            try:
+                samples.append((self.name, key, function()))
+            except Exception as e:
+                print(f"Error reading gauge {self.name}: {e}")
+        return samples
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+            values[-2] += value
+            values[-1] += 1
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(self.name, labels, value)
+
+    @contextmanager
+    def time(self, **labels):
+        # Observes the duration of the block, also when it raises
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, values in self._values.items():
+                for bound, count in zip(self.buckets, values):
+                    samples.append((f'{self.name}_bucket', key + (('le', _format_value(float(bound))),), count))
+                samples.append((f'{self.name}_bucket', key + (('le', '+Inf'),), values[-1]))
+                samples.append((f'{self.name}_sum', key, values[-2]))
+                samples.append((f'{self.name}_count', key, values[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help_text, **kwargs):
+        # Modules define their metrics at import time, asking twice for a name returns the same metric
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, help_text):
+        return self._get_or_create(Counter, name, help_text)
+
+    def gauge(self, name, help_text):
+        return self._get_or_create(Gauge, name, help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, key, value in metric.samples():
+                lines.append(f'{name}{_format_labels(key)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class Trace:
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.spans = []  # (stage, labels, seconds) in the order they finished
+        self._lock = threading.Lock()
+
+    def add(self, stage, labels, seconds):
+        with self._lock:
+            self.spans.append((stage, labels, seconds))
+
+    def server_timing(self):
+        # Value for the Server-Timing response header, shown by browser dev tools
+        with self._lock:
+            return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, _, seconds in self.spans)
+
+    def summary(self):
+        with self._lock:
+            return ' '.join(f'{stage}={seconds * 1000:.1f}ms' for stage, _, seconds in self.spans)
+
+
+def start_trace(trace_id=None):
+    # Returns (trace, token), pass the token to end_trace when the request is done
+    trace = Trace(trace_id)
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    _current_trace.reset(token)
+
+
+registry = Registry()
+counter = registry.counter
+gauge = registry.gauge
+histogram = registry.histogram
+render = registry.render
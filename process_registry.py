@@ -0,0 +1,202 @@
+#Tracks running script processes per browser session and run id. Output is kept in a bounded per-run buffer as soon as the process writes it, polling and streaming clients each read it from their own offset, and idle or finished runs are reaped in the background.
+import codecs
+import os
+import threading
+import time
+import uuid
+
+import metrics
+
+SCRIPT_RUNTIME_SECONDS = metrics.histogram('script_runtime_seconds', 'Wall-clock time of script runs, including time spent waiting for input')
+
+# Stands in for output a reader had not reached before it was trimmed from the buffer
+DROPPED_OUTPUT = '[... earlier output dropped ...]\n'
+
+
+class ScriptRun:
+    def __init__(self, session_id, script_name, process, max_output=1024 * 1024):
+        # max_output bounds the characters of output held, the oldest chunks are trimmed past it
+        self.run_id = str(uuid.uuid4())
+        self.session_id = session_id
+        self.script_name = script_name
+        self.process = process
+        self.max_output = max_output
+        self._chunks = []  # Recent output, readers index into it by offset counted from the first chunk ever written
+        self._trimmed = 0  # Chunks trimmed from the front, the offset of self._chunks[0]
+        self._buffered = 0  # Characters held in self._chunks
+        self._changed = threading.Condition()
+        self._read_offset = 0  # How far read() has returned output, shared by /run_script and /script_input
+        self._read_lock = threading.Lock()
+        self.created = time.time()
+        self.last_activity = self.created
+        self.finished = None
+        self._open_streams = 2
+        self._lock = threading.Lock()
+        for stream in (process.stdout, process.stderr):
+            threading.Thread(target=self._reader, args=(stream,), daemon=True).start()
+
+    def _reader(self, stream):
+        # Read whatever the process has written, partial lines included, so prompts
+        # like input('Name?') reach the client without waiting for a newline
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        fd = stream.fileno()
+        while True:
+            try:
+                data = os.read(fd, 4096)
+            except OSError:
+                data = b''
+            if not data:
+                break
+            text = decoder.decode(data)
+            if text:
+                self.last_activity = time.time()
+                with self._changed:
+                    self._chunks.append(text)
+                    self._buffered += len(text)
+                    while self._buffered > self.max_output and len(self._chunks) > 1:
+                        self._buffered -= len(self._chunks.pop(0))
+                        self._trimmed += 1
+                    self._changed.notify_all()
+        stream.close()
+        with self._lock:
+            self._open_streams -= 1
+            if self._open_streams == 0:
+                # Both streams hit EOF, the process is done writing
+                self.process.wait()
+                try:
+                    self.process.stdin.close()
+                except OSError:
+                    pass
+                with self._changed:
+                    self.finished = time.time()
+                    self._changed.notify_all()
+                SCRIPT_RUNTIME_SECONDS.observe(self.finished - self.created, outcome='ok' if self.process.returncode == 0 else 'error')
+
+    def is_finished(self):
+        return self.finished is not None
+
+    def write(self, text):
+        self.last_activity = time.time()
+        self.process.stdin.write(text)
+        self.process.stdin.flush()
+
+    def _next(self, offset, timeout):
+        # Waits up to timeout for output past offset. Returns (new chunks, next offset, finished), finished
+        # is only set once the process exited, so the chunks returned with it are the last ones
+        with self._changed:
+            self._changed.wait_for(lambda: self._trimmed + len(self._chunks) > offset or self.finished is not None, timeout)
+            end = self._trimmed + len(self._chunks)
+            if offset < self._trimmed:
+                # The reader fell behind the buffer, it continues from the oldest output still held
+                return [DROPPED_OUTPUT] + self._chunks, end, self.finished is not None
+            return self._chunks[offset - self._trimmed:], end, self.finished is not None
+
+    def read(self, first_timeout=2.0, quiet=0.2):
+        # Wait up to first_timeout for output, then keep collecting until the process
+        # finishes or goes quiet. Returns (output, finished)
+        with self._read_lock:
+            chunks = []
+            timeout = first_timeout
+            while True:
+                new, self._read_offset, finished = self._next(self._read_offset, timeout)
+                chunks.extend(new)
+                if finished:
+                    return ''.join(chunks), True
+                if not new:
+                    return ''.join(chunks), False
+                timeout = quiet
+
+    def stream(self, heartbeat=15.0):
+        # Yields all output from the start, including what read() already returned, as it arrives.
+        # Whatever is buffered goes out as one chunk, '' is a keep-alive, and it stops once the process ended
+        offset = 0
+        while True:
+            new, offset, finished = self._next(offset, heartbeat)
+            if new:
+                yield ''.join(new)
+            if finished:
+                return
+            if not new:
+                yield ''
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+
+    def to_dict(self):
+        return {
+            'run_id': self.run_id,
+            'script_name': self.script_name,
+            'running': not self.is_finished(),
+            'returncode': self.process.returncode,
+            'created': self.created,
+            'last_activity': self.last_activity,
+        }
+
+
+class ProcessRegistry:
+    def __init__(self, max_per_session=3, max_total=20, idle_timeout=600, finished_ttl=300, max_output=1024 * 1024):
+        # idle_timeout kills runs with no input or output for that long,
+        # finished runs are dropped finished_ttl seconds after they exit,
+        # max_output bounds the characters of output each run keeps
+        self.max_per_session = max_per_session
+        self.max_output = max_output
+        self.max_total = max_total
+        self.idle_timeout = idle_timeout
+        self.finished_ttl = finished_ttl
+        self._runs = {}
+        self._lock = threading.Lock()
+        self.reaped = 0
+
+    def register(self, session_id, script_name, start):
+        # start() launches the process, it is only called when the caps allow another run
+        with self._lock:
+            active = [run for run in self._runs.values() if not run.is_finished()]
+            if len(active) >= self.max_total:
+                raise RuntimeError('Too many scripts are running, try again shortly')
+            if sum(1 for run in active if run.session_id == session_id) >= self.max_per_session:
+                raise RuntimeError(f"At most {self.max_per_session} scripts can run at once per session")
+            run = ScriptRun(session_id, script_name, start(), self.max_output)
+            self._runs[run.run_id] = run
+            return run
+
+    def get(self, session_id, run_id):
+        with self._lock:
+            run = self._runs.get(run_id)
+        if run is None or run.session_id != session_id:
+            return None
+        return run
+
+    def latest(self, session_id, script_name):
+        # Most recent run of a script in this session, for clients that only know the script name
+        with self._lock:
+            runs = [run for run in self._runs.values() if run.session_id == session_id and run.script_name == script_name]
+        return max(runs, key=lambda run: run.created) if runs else None
+
+    def reap(self):
+        now = time.time()
+        with self._lock:
+            runs = list(self._runs.values())
+        for run in runs:
+            if not run.is_finished() and now - run.last_activity > self.idle_timeout:
+                run.kill()
+            elif run.is_finished() and now - run.finished > self.finished_ttl:
+                with self._lock:
+                    self._runs.pop(run.run_id, None)
+                self.reaped += 1
+
+    def start_reaper(self, interval=30):
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.reap()
+        threading.Thread(target=loop, daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            runs = list(self._runs.values())
+        return {
+            'running': sum(1 for run in runs if not run.is_finished()),
+            'finished': sum(1 for run in runs if run.is_finished()),
+            'reaped': self.reaped,
+        }
@@ -0,0 +1,90 @@
+#Caches chat answers for repeated questions. Entries are keyed on the normalized message, the recent history and the workbook version, so any write to the spreadsheet invalidates them.
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_message(message):
+    # "Who is enrolled?" and "who is  enrolled" should share an entry
+    message = " ".join(message.lower().split())
+    return re.sub(r"[\s?.!]+$", "", message)
+
+
+class ResponseCache:
+    def __init__(self, max_entries=256, ttl=3600, history_window=4):
+        # history_window is how many previous messages take part in the key
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.history_window = history_window
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def make_key(self, message, history):
+        window = [
+            {"role": msg["role"], "content": msg["content"]}
+            for msg in history[1:]
+            if msg["role"] in ["user", "assistant"]
+        ][-self.history_window:] if self.history_window else []
+        history_digest = hashlib.sha256(json.dumps(window, sort_keys=True).encode('utf-8')).hexdigest()
+        return f"{normalize_message(message)}\n{history_digest}"
+
+    def _check_version(self, version):
+        # Versions are ordered, e.g. WorkbookCache.stamp. A newer workbook version makes every cached
+        # answer stale, an older one comes from a request that started before the change and is stale
+        # itself, it returns False and leaves the cache alone
+        if version == self._version:
+            return True
+        if self._version is not None and (version is None or version < self._version):
+            return False
+        if self._entries:
+            self.invalidations += 1
+        self._entries.clear()
+        self._version = version
+        return True
+
+    def get(self, key, version):
+        with self._lock:
+            if not self._check_version(version):
+                self.misses += 1
+                return None
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[1] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, version, response):
+        with self._lock:
+            # An answer computed against an older workbook is not cached
+            if not self._check_version(version):
+                return
+            self._entries[key] = (response, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'invalidations': self.invalidations,
+            }
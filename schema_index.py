@@ -0,0 +1,225 @@
+#Selects the part of the workbook notes a prompt is about. The notes written by excel_format.py are parsed into an index of sheets, columns and sample rows, prompts are matched against it by keyword and fuzzy matching, and only the matching sheets and columns are written to a compact notes file for the Coder.
+import ast
+import difflib
+import os
+import re
+import threading
+import uuid
+from contextlib import contextmanager
+
+import metrics
+
+NOTES_BYTES = metrics.histogram('aider_notes_bytes', 'Size of the notes file handed to Aider',
+                                buckets=(500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000))
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'do', 'does', 'for', 'from', 'get', 'give', 'has', 'have',
+    'how', 'i', 'in', 'is', 'it', 'list', 'many', 'me', 'much', 'of', 'on', 'or', 'show', 'that', 'the', 'their',
+    'them', 'there', 'this', 'to', 'was', 'were', 'what', 'when', 'where', 'which', 'who', 'with', 'all', 'add',
+    'new', 'find', 'into', 'under', 'sheet', 'excel', 'spreadsheet', 'row', 'rows', 'column', 'columns',
+}
+
+# Weights of a prompt word matching a sheet name, a column name or a value in the sample rows
+SHEET_WEIGHT = 3
+COLUMN_WEIGHT = 2
+VALUE_WEIGHT = 0.5
+# Sheets scoring below this fraction of the best match are left out
+RELATIVE_CUTOFF = 0.34
+# Wide sheets matched as a whole, like one column per attendance date, only profile their first columns
+MAX_PROFILE_COLUMNS = 8
+
+
+def words(text):
+    # Lowercase words with a plural s dropped, so "students" matches the "Student Name" column
+    result = set()
+    for word in re.findall(r'[a-z0-9]+', str(text).lower()):
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        result.add(word)
+    return result
+
+
+def match_score(prompt_words, target_words, fuzzy_cutoff=0.8):
+    # Exact word matches count fully, near misses like "attendence" or "birthday" count half
+    score = 0.0
+    for word in prompt_words:
+        if word in target_words:
+            score += 1
+        elif len(word) > 3 and difflib.get_close_matches(word, target_words, n=1, cutoff=fuzzy_cutoff):
+            score += 0.5
+    return score
+
+
+def parse_sample(sample):
+    # Samples are written as tuple reprs, values like datetimes cannot be parsed back and keep the raw line
+    try:
+        values = ast.literal_eval(sample)
+    except (ValueError, SyntaxError):
+        return None
+    return values if isinstance(values, tuple) else None
+
+
+def parse_notes(text):
+    # Reads the layout written by excel_format.write_notes into {sheet: {'columns', 'samples', 'profile'}}
+    sheets = {}
+    sheet = None
+    section = None
+    for line in text.splitlines():
+        if line.startswith('Analyzing Sheet: '):
+            sheet = sheets.setdefault(line[len('Analyzing Sheet: '):], {'columns': [], 'samples': [], 'profile': {}})
+            section = None
+        elif sheet is None:
+            continue
+        elif line.startswith('Column Names:'):
+            section = 'columns'
+        elif line.startswith('Sample Data'):
+            section = 'samples'
+        elif line.startswith('Column Profile'):
+            section = 'profile'
+            sheet['profile_header'] = line
+        elif not line.strip():
+            continue
+        elif section == 'columns' and line.startswith('- '):
+            sheet['columns'].append(line[2:])
+        elif section == 'samples':
+            sheet['samples'].append(line)
+        elif section == 'profile' and line.startswith('- '):
+            name = line[2:].split(':', 1)[0]
+            sheet['profile'][name] = line
+    return sheets
+
+
+class SchemaIndex:
+    def __init__(self, notes_file, workbook_name, sheets):
+        self.notes_file = notes_file
+        self.workbook_name = workbook_name
+        self.sheets = sheets
+        # Word sets are built once per notes file, matching a prompt only tokenizes the prompt
+        self._sheet_words = {name: words(name) for name in sheets}
+        self._column_words = {name: [words(column) for column in sheet['columns']] for name, sheet in sheets.items()}
+        self._value_words = {}
+        for name, sheet in sheets.items():
+            values = set()
+            # Sample rows and the example values in the profile, e.g. "Friday" in the Schedule column
+            for text in sheet['samples'] + list(sheet['profile'].values()):
+                values |= words(text)
+            self._value_words[name] = values
+
+    @classmethod
+    def from_notes(cls, notes_file):
+        with open(notes_file) as f:
+            text = f.read()
+        match = re.search(r'^Excel File Name: (.*)$', text, re.MULTILINE)
+        return cls(notes_file, match.group(1) if match else None, parse_notes(text))
+
+    def select(self, prompt):
+        # Returns {sheet: [indexes of matched columns]}, an empty list means the sheet matched as a whole.
+        # Bare numbers are left out, they match dates and amounts all over the workbook
+        prompt_words = {word for word in words(prompt) - STOPWORDS if not word.isdigit()}
+        selected = {}
+        for name in self.sheets:
+            sheet_score = SHEET_WEIGHT * match_score(prompt_words, self._sheet_words[name])
+            columns = [i for i, column_words in enumerate(self._column_words[name])
+                       if match_score(prompt_words, column_words) > 0]
+            value_score = VALUE_WEIGHT * match_score(prompt_words, self._value_words[name], fuzzy_cutoff=0.9)
+            score = sheet_score + COLUMN_WEIGHT * len(columns) + value_score
+            if score > 0:
+                selected[name] = (score, columns)
+        if not selected:
+            return {}
+        # Sheets that only share a generic word like "Name" with the prompt are dropped next to clear matches
+        cutoff = max(score for score, _ in selected.values()) * RELATIVE_CUTOFF
+        ranked = sorted(selected.items(), key=lambda item: -item[1][0])
+        return {name: columns for name, (score, columns) in ranked if score >= cutoff}
+
+    def render(self, selection):
+        # Compact notes for the selected sheets: matched columns in full, the rest by name only
+        lines = [f"Excel File Name: {self.workbook_name}",
+                 f"Sheet Names: {', '.join(self.sheets)}",
+                 "Only the sheets and columns relevant to the request are described below."]
+        for name, columns in selection.items():
+            sheet = self.sheets[name]
+            lines.append(f"\nSheet: {name}")
+            if columns and 0 not in columns:
+                columns = [0] + columns  # The first column names the row, keep it for lookups
+            if not columns or len(columns) == len(sheet['columns']):
+                lines.append(f"Columns: {', '.join(sheet['columns'])}")
+                lines.append("Sample Data:")
+                lines.extend(sheet['samples'])
+                profile = list(sheet['profile'].values())
+                if len(profile) > MAX_PROFILE_COLUMNS:
+                    profile = profile[:MAX_PROFILE_COLUMNS] + [f"- ... {len(profile) - MAX_PROFILE_COLUMNS} more columns not profiled here"]
+            else:
+                # Every column name is kept, in order, so rows can still be written in the right layout
+                lines.append(f"Columns: {', '.join(sheet['columns'])}")
+                lines.append(f"Relevant Columns: {', '.join(sheet['columns'][i] for i in columns)}")
+                lines.append("Sample Data (relevant columns):")
+                for sample in sheet['samples']:
+                    values = parse_sample(sample)
+                    if values is None:
+                        lines.append(sample)
+                    else:
+                        lines.append(repr({sheet['columns'][i]: values[i] for i in columns if i < len(values)}))
+                profile = [sheet['profile'][sheet['columns'][i]] for i in columns if sheet['columns'][i] in sheet['profile']]
+            if profile:
+                lines.append(sheet.get('profile_header', 'Column Profile:'))
+                lines.extend(profile)
+        return '\n'.join(lines) + '\n'
+
+
+_indexes = {}  # notes file -> (mtime, size, SchemaIndex)
+_lock = threading.Lock()
+
+
+def get_index(notes_file):
+    # Parsed once per version of the notes file
+    stat = os.stat(notes_file)
+    with _lock:
+        cached = _indexes.get(notes_file)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+    index = SchemaIndex.from_notes(notes_file)
+    with _lock:
+        _indexes[notes_file] = (stat.st_mtime_ns, stat.st_size, index)
+    return index
+
+
+def write_prompt_notes(notes_file, prompt, target_file, notes_dir=os.path.join('cache', 'notes')):
+    # Returns the notes file to give the Coder for this prompt. The compact notes get a file of their
+    # own per call, so concurrent prompts for the same target script never read each other's notes.
+    # Falls back to the full notes when retrieval is off, the notes are missing or nothing matched.
+    if os.getenv('SCHEMA_RETRIEVAL', '1') == '0' or not os.path.exists(notes_file):
+        return notes_file
+    try:
+        index = get_index(notes_file)
+        selection = index.select(prompt)
+    except Exception as e:
+        print(f"Schema retrieval failed, using the full notes: {e}")
+        return notes_file
+    if not selection:
+        NOTES_BYTES.observe(os.path.getsize(notes_file), selection='full')
+        return notes_file
+
+    notes = index.render(selection)
+    os.makedirs(notes_dir, exist_ok=True)
+    path = os.path.join(notes_dir, f"{os.path.basename(target_file)}.{uuid.uuid4().hex}.{os.path.basename(notes_file)}")
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write(notes)
+    os.replace(temp_path, path)
+    NOTES_BYTES.observe(len(notes.encode('utf-8')), selection='selected')
+    return path
+
+
+@contextmanager
+def prompt_notes(notes_file, prompt, target_file, notes_dir=os.path.join('cache', 'notes')):
+    # Yields the notes file for one Coder run and removes the compact copy once the run is over
+    path = write_prompt_notes(notes_file, prompt, target_file, notes_dir)
+    try:
+        yield path
+    finally:
+        if path != notes_file:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,108 @@
+#Pool of pre-started script_worker.py interpreters. Each worker runs a single script, so runs stay isolated, and a replacement is started in the background as soon as one is handed out.
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import metrics
+
+SCRIPT_START_SECONDS = metrics.histogram('script_start_seconds', 'Time to hand a script to a worker process, from the pool or freshly spawned')
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'script_worker.py')
+
+
+class ScriptWorkerPool:
+    def __init__(self, workbook_path, size=2, timeout=300, max_memory_mb=1024):
+        # timeout is the wall-clock limit for one script run, including time spent waiting for input
+        self.workbook_path = workbook_path
+        self.size = size
+        self.timeout = timeout
+        self.max_memory_mb = max_memory_mb
+        self._idle = []  # (process, workbook_mtime)
+        self._lock = threading.Lock()
+        self._filling = False
+        self.started = 0
+        self.recycled = 0
+
+    def _workbook_mtime(self):
+        try:
+            return os.stat(self.workbook_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _spawn(self):
+        process = subprocess.Popen([sys.executable, '-u', WORKER_SCRIPT, self.workbook_path],
+                                   stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   text=True,
+                                   bufsize=1,
+                                   universal_newlines=True)
+        return process, self._workbook_mtime()
+
+    def fill(self):
+        # Top the pool back up to size, called in the background after each checkout
+        with self._lock:
+            if self._filling:
+                return
+            self._filling = True
+        try:
+            while True:
+                with self._lock:
+                    if len(self._idle) >= self.size:
+                        break
+                worker = self._spawn()
+                with self._lock:
+                    self._idle.append(worker)
+        finally:
+            with self._lock:
+                self._filling = False
+
+    def _recycle_stale(self):
+        # Workers that preloaded an older workbook, or died, are replaced
+        mtime = self._workbook_mtime()
+        fresh = []
+        for process, worker_mtime in self._idle:
+            if worker_mtime == mtime and process.poll() is None:
+                fresh.append((process, worker_mtime))
+            else:
+                process.kill()
+                self.recycled += 1
+        self._idle = fresh
+
+    def start(self, script_path, lock_dir=None):
+        # Returns a running process with stdin/stdout/stderr pipes, like subprocess.Popen.
+        # With lock_dir the worker holds workbook_lock(workbook, lock_dir) while the script edits the workbook
+        start = time.perf_counter()
+        with self._lock:
+            self._recycle_stale()
+            worker = self._idle.pop(0) if self._idle else None
+        source = 'pool' if worker is not None else 'spawn'
+        if worker is None:
+            worker = self._spawn()
+        process = worker[0]
+        self.started += 1
+
+        process.stdin.write(json.dumps({'script': script_path, 'max_memory_mb': self.max_memory_mb, 'lock_dir': lock_dir}) + '\n')
+        process.stdin.flush()
+        SCRIPT_START_SECONDS.observe(time.perf_counter() - start, source=source)
+
+        # Kill scripts that run past the timeout
+        timer = threading.Timer(self.timeout, lambda: process.poll() is None and process.kill())
+        timer.daemon = True
+        timer.start()
+
+        threading.Thread(target=self.fill, daemon=True).start()
+        return process
+
+    def shutdown(self):
+        with self._lock:
+            for process, _ in self._idle:
+                process.kill()
+            self._idle = []
+
+    def stats(self):
+        with self._lock:
+            return {'idle': len(self._idle), 'started': self.started, 'recycled': self.recycled}
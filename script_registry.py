@@ -0,0 +1,79 @@
+#Remembers the scripts Aider generated for each prompt so an equivalent request can restore the stored script instead of calling the LLM again. Entries are keyed on the target script file, the normalized prompt and the hash of the schema notes the script was written against.
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from response_cache import normalize_message
+
+
+def notes_digest(notes_file):
+    # Hash of the schema notes, an empty digest when the notes were never generated
+    try:
+        with open(notes_file, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return ''
+
+
+class ScriptRegistry:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(scripts)")]
+            if columns and 'target_file' not in columns:
+                # Entries from before scripts were keyed on their target file, they can be regenerated
+                conn.execute("DROP TABLE scripts")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS scripts ("
+                "kind TEXT NOT NULL, target_file TEXT NOT NULL, prompt TEXT NOT NULL, notes_file TEXT NOT NULL, "
+                "notes_hash TEXT NOT NULL, content TEXT NOT NULL, result TEXT, created REAL NOT NULL, "
+                "hits INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (kind, target_file, prompt, notes_hash))"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def lookup(self, kind, target_file, user_prompt, notes_file):
+        # Returns (script source, Aider's reply when it was generated), or None
+        notes_hash = notes_digest(notes_file)
+        prompt = normalize_message(user_prompt)
+        with self._lock, self._connect() as conn:
+            # Scripts written against an older schema may no longer match the workbook
+            conn.execute("DELETE FROM scripts WHERE notes_file = ? AND notes_hash != ?", (notes_file, notes_hash))
+            row = conn.execute(
+                "SELECT content, result FROM scripts WHERE kind = ? AND target_file = ? AND prompt = ? AND notes_hash = ?",
+                (kind, target_file, prompt, notes_hash),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE scripts SET hits = hits + 1 WHERE kind = ? AND target_file = ? AND prompt = ? AND notes_hash = ?",
+                (kind, target_file, prompt, notes_hash),
+            )
+            return row
+
+    def generated(self, kind, target_file):
+        # True when a script of this kind was generated into target_file
+        with self._lock, self._connect() as conn:
+            return conn.execute("SELECT 1 FROM scripts WHERE kind = ? AND target_file = ? LIMIT 1",
+                                (kind, target_file)).fetchone() is not None
+
+    def store(self, kind, target_file, user_prompt, notes_file, content, result):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO scripts (kind, target_file, prompt, notes_file, notes_hash, content, result, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, target_file, normalize_message(user_prompt), notes_file, notes_digest(notes_file), content,
+                 None if result is None else str(result), time.time()),
+            )
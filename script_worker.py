@@ -0,0 +1,101 @@
+#Warm interpreter for running generated scripts. It imports openpyxl and loads the workbook ahead of time, then waits for one line naming the script to run. The script keeps the worker's stdin and stdout, so interactive input works as with a plain `python -u` process.
+import json
+import os
+import runpy
+import sys
+import traceback
+
+import openpyxl
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def preload_workbook(workbook_path):
+    # Serve the preloaded copy to the script's own load_workbook call when it asks for the same file with default options
+    real_load_workbook = openpyxl.load_workbook
+    try:
+        preloaded = real_load_workbook(workbook_path)
+        preloaded_mtime = os.stat(workbook_path).st_mtime_ns
+    except Exception:
+        return
+
+    def load_workbook(filename, *args, **kwargs):
+        nonlocal preloaded
+        if (preloaded is not None and not args and not kwargs and isinstance(filename, (str, os.PathLike))
+                and os.path.abspath(filename) == os.path.abspath(workbook_path)
+                and os.stat(workbook_path).st_mtime_ns == preloaded_mtime):
+            workbook, preloaded = preloaded, None
+            return workbook
+        return real_load_workbook(filename, *args, **kwargs)
+
+    openpyxl.load_workbook = load_workbook
+    openpyxl.reader.excel.load_workbook = load_workbook
+
+
+def lock_workbook_writes(workbook_path, lock_dir):
+    # Hold the append queue's workbook_lock from the script's load of the workbook until it saves it,
+    # so rows appended by the app in between are not overwritten. Exiting the process releases it too
+    from workbook_writer import workbook_lock
+    real_load_workbook = openpyxl.load_workbook
+    real_save = openpyxl.Workbook.save
+    held = []
+
+    def is_workbook(filename):
+        return isinstance(filename, (str, os.PathLike)) and os.path.abspath(filename) == os.path.abspath(workbook_path)
+
+    def load_workbook(filename, *args, **kwargs):
+        if is_workbook(filename) and not kwargs.get('read_only') and not held:
+            lock = workbook_lock(workbook_path, lock_dir)
+            lock.__enter__()
+            held.append(lock)
+        return real_load_workbook(filename, *args, **kwargs)
+
+    def save(self, filename):
+        real_save(self, filename)
+        if is_workbook(filename) and held:
+            held.pop().__exit__(None, None, None)
+
+    openpyxl.load_workbook = load_workbook
+    openpyxl.reader.excel.load_workbook = load_workbook
+    openpyxl.Workbook.save = save
+
+
+def main():
+    workbook_path = sys.argv[1] if len(sys.argv) > 1 else None
+    if workbook_path:
+        preload_workbook(workbook_path)
+
+    # Block until the app hands this worker a script
+    control = sys.stdin.readline()
+    if not control:
+        return
+    request = json.loads(control)
+
+    if resource is not None and request.get('max_memory_mb'):
+        limit = request['max_memory_mb'] * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    if workbook_path and request.get('lock_dir'):
+        lock_workbook_writes(workbook_path, request['lock_dir'])
+
+    script_path = request['script']
+    sys.argv = [script_path]
+    # Like `python script.py`, the script's own directory comes first on the import path
+    worker_path = sys.path[0]
+    sys.path[0] = os.path.dirname(os.path.abspath(script_path))
+    try:
+        runpy.run_path(script_path, run_name='__main__')
+    except SystemExit:
+        raise
+    except BaseException:
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        sys.path[0] = worker_path
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#Caches image transcriptions by the hash of the image content, so uploading the same sheet again does not pay for another API call. Entries live in an in-memory LRU with an optional on-disk layer.
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+def image_hash(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class TranscriptionCache:
+    def __init__(self, max_entries=256, disk_dir=None, max_disk_entries=5000):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key)) as f:
+                    transcription = json.load(f)['transcription']
+            except (OSError, ValueError, KeyError):
+                transcription = None
+            if transcription is not None:
+                self._remember(key, transcription)
+                with self._lock:
+                    self.hits += 1
+                return transcription
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, transcription):
+        self._remember(key, transcription)
+        if self.disk_dir:
+            temp_path = self._disk_path(key) + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump({'transcription': transcription}, f)
+            os.replace(temp_path, self._disk_path(key))
+            self._prune_disk()
+
+    def _remember(self, key, transcription):
+        with self._lock:
+            self._entries[key] = transcription
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _prune_disk(self):
+        # Drop the oldest files once the disk layer grows past its limit
+        files = [os.path.join(self.disk_dir, name) for name in os.listdir(self.disk_dir) if name.endswith('.json')]
+        if len(files) <= self.max_disk_entries:
+            return
+        files.sort(key=os.path.getmtime)
+        for path in files[:len(files) - self.max_disk_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
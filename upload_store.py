@@ -0,0 +1,120 @@
+#Tracks uploaded files with an expiry index so one periodic sweep deletes everything that expired, instead of one scheduled job per file. The index is rebuilt from file modification times on startup and a disk quota evicts the oldest uploads that are no longer being processed.
+import heapq
+import os
+import threading
+import time
+
+
+class UploadStore:
+    def __init__(self, folder, ttl=3600, quota_bytes=512 * 1024 * 1024, min_age=600):
+        # Uploads younger than min_age seconds may still be read by the request, or image job,
+        # that saved them, in this or another worker process. The quota never evicts them
+        self.folder = folder
+        self.ttl = ttl
+        self.quota_bytes = quota_bytes
+        self.min_age = min_age
+        self._heap = []  # (expires, path), stale entries are skipped lazily
+        self._index = {}  # path -> (expires, size)
+        self._lock = threading.Lock()
+        self.deleted = 0
+        os.makedirs(folder, exist_ok=True)
+        self._rebuild()
+
+    def _rebuild(self):
+        # Uploads left over from before a restart expire ttl seconds after they were written
+        with self._lock:
+            self._rescan()
+
+    def _track(self, path, expires, size):
+        self._index[path] = (expires, size)
+        heapq.heappush(self._heap, (expires, path))
+
+    def save(self, file_storage, filename):
+        path = os.path.join(self.folder, filename)
+        file_storage.save(path)
+        self.add(path)
+        return path
+
+    def add(self, path):
+        # Expired entries are dropped here too, so workers that do not run the sweep keep a bounded index.
+        # Raises RuntimeError, and deletes the new upload, when evicting older uploads cannot make room for it
+        with self._lock:
+            self._track(path, time.time() + self.ttl, os.path.getsize(path))
+            evicted = self._expired(time.time()) + self._over_quota()
+            rejected = sum(size for _, size in self._index.values()) > self.quota_bytes
+            if rejected:
+                self._index.pop(path)
+                evicted.append(path)
+        self._delete(evicted)
+        if rejected:
+            raise RuntimeError('The upload folder is full, try again once earlier uploads have been processed')
+
+    def remove(self, path):
+        with self._lock:
+            self._index.pop(path, None)
+        self._delete([path])
+
+    def _over_quota(self):
+        # Oldest uploads go first once the folder exceeds its quota. An upload a request may still be
+        # reading is never evicted, add() rejects the new upload instead
+        evicted = []
+        used = sum(size for _, size in self._index.values())
+        # Entries expiring after this were written less than min_age ago
+        cutoff = time.time() + self.ttl - self.min_age
+        while used > self.quota_bytes and self._heap:
+            expires, path = heapq.heappop(self._heap)
+            if self._index.get(path, (None,))[0] != expires:
+                continue
+            if expires > cutoff:
+                # The heap is ordered by age, every remaining upload is as young
+                heapq.heappush(self._heap, (expires, path))
+                break
+            used -= self._index.pop(path)[1]
+            evicted.append(path)
+        return evicted
+
+    def _expired(self, now):
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            expires, path = heapq.heappop(self._heap)
+            if self._index.get(path, (None,))[0] == expires:
+                del self._index[path]
+                expired.append(path)
+        return expired
+
+    def _rescan(self):
+        # Tracks files not in the index yet, left from before a restart or saved by other worker processes
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and entry.path not in self._index:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                self._track(entry.path, stat.st_mtime + self.ttl, stat.st_size)
+
+    def sweep(self, rescan=False):
+        # Pop every expired entry off the heap and delete the files in one batch
+        with self._lock:
+            if rescan:
+                self._rescan()
+            expired = self._expired(time.time())
+        self._delete(expired)
+        return len(expired)
+
+    def _delete(self, paths):
+        for path in paths:
+            try:
+                os.remove(path)
+                self.deleted += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Error deleting upload {path}: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._index),
+                'bytes': sum(size for _, size in self._index.values()),
+                'deleted': self.deleted,
+            }
@@ -0,0 +1,146 @@
+#Keeps parsed openpyxl workbooks in memory so repeated reads of the same spreadsheet skip the full XLSX parse. Entries are invalidated when the file's mtime or content hash changes.
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+
+WORKBOOK_LOAD_SECONDS = metrics.histogram('workbook_load_seconds', 'Time to parse the workbook with openpyxl')
+
+
+def file_hash(file_path, chunk_size=1024 * 1024):
+    # Hash the file in chunks so large workbooks are not read into memory at once
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class WorkbookCache:
+    def __init__(self, max_bytes=256 * 1024 * 1024, max_entries=8):
+        # max_bytes bounds the total on-disk size of the cached workbooks,
+        # least recently used workbooks are evicted first
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._hashes = {}  # path -> (mtime, size, content hash), kept apart from parsed entries
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, file_path):
+        # Return a fresh cache entry for file_path, reloading it if the file changed
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        entry = self._entries.get(path)
+
+        if entry and entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return entry
+
+        # The mtime moved, only reparse if the content actually changed
+        digest = self._hash(path, stat)
+        if entry and entry['hash'] == digest:
+            entry['mtime'] = stat.st_mtime_ns
+            entry['size'] = stat.st_size
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        if entry:
+            self._drop(path)
+        import openpyxl  # Loaded on the first parse rather than at app startup
+        with WORKBOOK_LOAD_SECONDS.time(source='cache'):
+            workbook = openpyxl.load_workbook(path, data_only=True)
+        entry = {
+            'workbook': workbook,
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'hash': digest,
+            'rows': {},
+        }
+        self._entries[path] = entry
+        self._evict(keep=path)
+        return entry
+
+    def _drop(self, path):
+        entry = self._entries.pop(path, None)
+        if entry:
+            entry['workbook'].close()
+
+    def _evict(self, keep=None):
+        # Evict least recently used entries until the cache fits its bounds again
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or self.total_bytes() > self.max_bytes
+        ):
+            oldest = next(iter(self._entries))
+            if oldest == keep:
+                break
+            self._drop(oldest)
+
+    def get(self, file_path):
+        # The returned workbook is shared between callers and must be treated as read-only
+        with self._lock:
+            return self._lookup(file_path)['workbook']
+
+    def get_sheet(self, file_path, sheet_name):
+        return self.get(file_path)[sheet_name]
+
+    def sheet_rows(self, file_path, sheet_name):
+        # Rows of a sheet as tuples of cell values, materialized once per workbook version
+        with self._lock:
+            entry = self._lookup(file_path)
+            rows = entry['rows'].get(sheet_name)
+            if rows is None:
+                sheet = entry['workbook'][sheet_name]
+                rows = [row for row in sheet.iter_rows(values_only=True)]
+                entry['rows'][sheet_name] = rows
+            return rows
+
+    def _hash(self, path, stat):
+        # Content hash of the file, recomputed only when its mtime or size moved
+        cached = self._hashes.get(path)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+        digest = file_hash(path)
+        self._hashes[path] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def version(self, file_path):
+        # Content hash of the workbook currently on disk, from stat and the file hash only,
+        # checking the version never parses the workbook
+        return self.stamp(file_path)[1]
+
+    def stamp(self, file_path):
+        # (mtime_ns, content hash), unlike the bare hash it orders versions by when they were written
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry and entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+                return stat.st_mtime_ns, entry['hash']
+            return stat.st_mtime_ns, self._hash(path, stat)
+
+    def invalidate(self, file_path=None):
+        with self._lock:
+            if file_path is None:
+                for path in list(self._entries):
+                    self._drop(path)
+            else:
+                self._drop(os.path.abspath(file_path))
+
+    def total_bytes(self):
+        return sum(entry['size'] for entry in self._entries.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.total_bytes(),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,186 @@
+#Mirrors every sheet of the Excel workbook into a SQLite table so lookups can run as indexed queries instead of openpyxl row scans. Only sheets whose contents changed are rebuilt on each sync.
+import datetime
+import hashlib
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from excel_format import get_column_names
+import metrics
+
+MIRROR_SYNC_SECONDS = metrics.histogram('workbook_mirror_sync_seconds', 'Time to check and refresh the SQLite mirror of the workbook')
+
+# Bumped when the table layout changes, an older mirror is dropped and rebuilt from the workbook
+SCHEMA_VERSION = 1
+
+
+def quote_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def sheet_table(sheet_name):
+    # Sheet tables are prefixed so a sheet named like _sheets cannot collide with the metadata table
+    return quote_identifier(f"sheet_{sheet_name}")
+
+
+def to_sql_value(value):
+    # Normalize cell values into types SQLite stores natively
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+def unique_columns(headers):
+    # Blank and repeated headers get positional or numbered names so every column is addressable
+    columns = []
+    seen = {'_row'}
+    for index, header in enumerate(headers, start=1):
+        name = str(header).strip() if header is not None and str(header).strip() else f"column_{index}"
+        candidate = name
+        suffix = 2
+        while candidate.lower() in seen:
+            candidate = f"{name}_{suffix}"
+            suffix += 1
+        seen.add(candidate.lower())
+        columns.append(candidate)
+    return columns
+
+
+class WorkbookMirror:
+    def __init__(self, workbook_path, db_path, cache):
+        self.workbook_path = workbook_path
+        self.db_path = db_path
+        self.cache = cache
+        self._synced_version = None
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+                for table in tables:
+                    conn.execute(f"DROP TABLE {quote_identifier(table)}")
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS _sheets ("
+                "sheet_name TEXT PRIMARY KEY, columns TEXT NOT NULL, content_hash TEXT NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        # Commit on success and always close, sqlite3's own context manager only commits
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def sync(self):
+        # Bring the mirror up to date with the workbook on disk, returns the names of rebuilt sheets
+        with self._lock, MIRROR_SYNC_SECONDS.time():
+            version = self.cache.version(self.workbook_path)
+            if version == self._synced_version:
+                return []
+
+            workbook = self.cache.get(self.workbook_path)
+            rebuilt = []
+            with self._connect() as conn:
+                # Take the write lock up front, other worker processes syncing at the same time wait
+                # and then find the sheets already rebuilt
+                conn.execute("BEGIN IMMEDIATE")
+                known = dict(conn.execute("SELECT sheet_name, content_hash FROM _sheets"))
+                for sheet_name in workbook.sheetnames:
+                    rows = self.cache.sheet_rows(self.workbook_path, sheet_name)
+                    content_hash = hashlib.sha256(repr(rows).encode('utf-8')).hexdigest()
+                    if known.pop(sheet_name, None) == content_hash:
+                        continue
+                    headers = get_column_names(workbook[sheet_name])
+                    self._rebuild_sheet(conn, sheet_name, headers, rows[1:], content_hash)
+                    rebuilt.append(sheet_name)
+
+                # Sheets removed from the workbook
+                for sheet_name in known:
+                    conn.execute(f"DROP TABLE IF EXISTS {sheet_table(sheet_name)}")
+                    conn.execute("DELETE FROM _sheets WHERE sheet_name = ?", (sheet_name,))
+
+            self._synced_version = version
+            return rebuilt
+
+    def _rebuild_sheet(self, conn, sheet_name, headers, data_rows, content_hash):
+        columns = unique_columns(headers)
+        table = sheet_table(sheet_name)
+        column_defs = ", ".join(quote_identifier(column) for column in columns)
+
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(f"CREATE TABLE {table} (_row INTEGER PRIMARY KEY, {column_defs})")
+
+        placeholders = ", ".join("?" for _ in range(len(columns) + 1))
+        records = []
+        # Excel row numbers start at 1 and row 1 holds the headers
+        for row_number, row in enumerate(data_rows, start=2):
+            if all(value is None for value in row):
+                continue
+            values = [to_sql_value(value) for value in row[:len(columns)]]
+            values += [None] * (len(columns) - len(values))
+            records.append([row_number] + values)
+        conn.executemany(f"INSERT INTO {table} VALUES ({placeholders})", records)
+
+        for index, column in enumerate(columns):
+            index_name = quote_identifier(f"idx_sheet_{sheet_name}_{index}")
+            conn.execute(f"CREATE INDEX {index_name} ON {table} ({quote_identifier(column)} COLLATE NOCASE)")
+
+        conn.execute(
+            "INSERT OR REPLACE INTO _sheets (sheet_name, columns, content_hash) VALUES (?, ?, ?)",
+            (sheet_name, "\n".join(columns), content_hash),
+        )
+
+    def columns(self, sheet_name):
+        self.sync()
+        with self._connect() as conn:
+            row = conn.execute("SELECT columns FROM _sheets WHERE sheet_name = ?", (sheet_name,)).fetchone()
+        if row is None:
+            raise KeyError(f"Sheet '{sheet_name}' not found")
+        return row[0].split("\n")
+
+    def query(self, sheet_name, where=None, columns=None, limit=100):
+        # Equality lookups on any header column, matched case-insensitively through the column indexes
+        if where is not None and not isinstance(where, dict):
+            raise ValueError("where must be an object mapping column names to values")
+        if columns is not None and not isinstance(columns, list):
+            raise ValueError("columns must be a list of column names")
+        if where and any(isinstance(value, (list, dict)) for value in where.values()):
+            raise ValueError("where values must be strings, numbers, booleans or null")
+        if limit is not None and (isinstance(limit, bool) or not isinstance(limit, int) or limit < 0):
+            raise ValueError("limit must be a non-negative integer")
+        known_columns = self.columns(sheet_name)
+        lookup = {column.lower(): column for column in known_columns}
+
+        def resolve(name):
+            if str(name).lower() not in lookup:
+                raise ValueError(f"Unknown column '{name}' in sheet '{sheet_name}'")
+            return lookup[str(name).lower()]
+
+        selected = [resolve(column) for column in columns] if columns else known_columns
+        sql = f"SELECT {', '.join(quote_identifier(column) for column in selected)} FROM {sheet_table(sheet_name)}"
+
+        params = []
+        if where:
+            clauses = []
+            for name, value in where.items():
+                clauses.append(f"{quote_identifier(resolve(name))} = ? COLLATE NOCASE")
+                params.append(to_sql_value(value))
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY _row"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        with self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [dict(zip(selected, row)) for row in rows]
@@ -0,0 +1,184 @@
+#Write-behind queue for appending rows to the Excel workbook. Rows queued within a short window are merged into one load-and-save cycle, done under a file lock and written atomically through a temp file.
+import itertools
+import os
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import metrics
+
+WORKBOOK_LOAD_SECONDS = metrics.histogram('workbook_load_seconds', 'Time to parse the workbook with openpyxl')
+WORKBOOK_SAVE_SECONDS = metrics.histogram('workbook_save_seconds', 'Time to write the workbook back to disk')
+APPEND_BATCH_ROWS = metrics.histogram('append_batch_rows', 'Rows written per append batch', buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500))
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, only the in-process lock applies there
+    fcntl = None
+
+_thread_lock = threading.Lock()
+
+
+@contextmanager
+def workbook_lock(workbook_path, lock_dir=None):
+    # Exclusive lock around a read-modify-write of the workbook, shared with any script that uses it
+    lock_dir = lock_dir or os.path.dirname(os.path.abspath(workbook_path))
+    lock_path = os.path.join(lock_dir, os.path.basename(workbook_path) + '.lock')
+    with _thread_lock:
+        with open(lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def last_populated_row(sheet):
+    # openpyxl's max_row counts formatted but empty rows, find the last row that holds a value
+    for row_number in range(sheet.max_row, 0, -1):
+        if any(cell.value is not None for cell in sheet[row_number]):
+            return row_number
+    return 0
+
+
+# Cell values a row may hold, the types JSON decodes to
+CELL_TYPES = (str, int, float, bool, type(None))
+
+
+def check_row(row):
+    # Rows may be lists in column order or dicts keyed by header name, holding one value per cell
+    if isinstance(row, dict):
+        values = row.values()
+    elif isinstance(row, (list, tuple)):
+        values = row
+    else:
+        raise ValueError(f"Each row must be a list or an object of cell values, got {type(row).__name__}")
+    for value in values:
+        if not isinstance(value, CELL_TYPES):
+            raise ValueError(f"Cell values must be strings, numbers, booleans or null, got {type(value).__name__}")
+
+
+def row_values(sheet, row):
+    check_row(row)
+    if not isinstance(row, dict):
+        return list(row)
+    headers = [str(cell.value).strip() if cell.value is not None else None for cell in sheet[1]]
+    unknown = [key for key in row if key not in headers]
+    if unknown:
+        raise ValueError(f"Unknown columns for sheet '{sheet.title}': {', '.join(unknown)}")
+    return [row.get(header) for header in headers]
+
+
+class WorkbookAppendQueue:
+    def __init__(self, workbook_path, temp_dir, batch_window=0.2, max_batch=500):
+        # temp_dir must be on the same filesystem as the workbook so the final rename is atomic
+        self.workbook_path = workbook_path
+        self.temp_dir = temp_dir
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._pending = queue.Queue()
+        self._batch_ids = itertools.count(1)
+        self.batches = 0
+        self.rows_written = 0
+        self._writer_thread = None
+        self._start_lock = threading.Lock()
+        os.makedirs(temp_dir, exist_ok=True)
+
+    def _start_writer(self):
+        # The writer thread starts with the first append, creating a queue starts no thread
+        with self._start_lock:
+            if self._writer_thread is None:
+                self._writer_thread = threading.Thread(target=self._writer, daemon=True)
+                self._writer_thread.start()
+
+    def submit(self, sheet_name, rows):
+        # Returns a Future resolving to {'batch_id', 'sheet', 'rows': [row numbers]}
+        self._start_writer()
+        future = Future()
+        self._pending.put((sheet_name, list(rows), future))
+        return future
+
+    def _writer(self):
+        while True:
+            batch = [self._pending.get()]
+            # Collect everything queued within the batching window
+            deadline = time.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._pending.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        import openpyxl  # Loaded on the first append rather than at app startup
+        batch_id = next(self._batch_ids)
+        try:
+            with workbook_lock(self.workbook_path, self.temp_dir):
+                with WORKBOOK_LOAD_SECONDS.time(source='append'):
+                    wb = openpyxl.load_workbook(self.workbook_path)
+                next_rows = {}
+                results = []
+                for sheet_name, rows, future in batch:
+                    if future.done():
+                        continue
+                    # A request that fails only fails its own future, its cells are cleared again
+                    # and the rest of the batch is saved without it
+                    written = []
+                    try:
+                        if sheet_name not in wb.sheetnames:
+                            raise KeyError(f"Sheet '{sheet_name}' not found")
+                        sheet = wb[sheet_name]
+                        if sheet_name not in next_rows:
+                            next_rows[sheet_name] = last_populated_row(sheet) + 1
+                        values = [row_values(sheet, row) for row in rows]
+                        row_number = next_rows[sheet_name]
+                        row_numbers = []
+                        for row in values:
+                            for column, value in enumerate(row, start=1):
+                                written.append(sheet.cell(row=row_number, column=column))
+                                written[-1].value = value
+                            row_numbers.append(row_number)
+                            row_number += 1
+                    except Exception as e:
+                        for cell in written:
+                            cell.value = None
+                        future.set_exception(e)
+                        continue
+                    next_rows[sheet_name] = row_number
+                    results.append((future, {'batch_id': batch_id, 'sheet': sheet_name, 'rows': row_numbers}))
+
+                if results:
+                    # Save to a temp file and rename it over the workbook so readers never see a partial file
+                    fd, temp_path = tempfile.mkstemp(suffix='.xlsx', dir=self.temp_dir)
+                    os.close(fd)
+                    try:
+                        with WORKBOOK_SAVE_SECONDS.time(source='append'):
+                            wb.save(temp_path)
+                        os.chmod(temp_path, os.stat(self.workbook_path).st_mode & 0o777)
+                        os.replace(temp_path, self.workbook_path)
+                    except BaseException:
+                        os.remove(temp_path)
+                        raise
+                wb.close()
+
+            self.batches += 1
+            APPEND_BATCH_ROWS.observe(sum(len(result['rows']) for _, result in results))
+            for future, result in results:
+                self.rows_written += len(result['rows'])
+                future.set_result(result)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def stats(self):
+        return {'pending': self._pending.qsize(), 'batches': self.batches, 'rows_written': self.rows_written}
@@ -0,0 +1,163 @@
+#State shared between the worker processes of a multi-worker deployment. Workers register an internal address, record which script runs and jobs they own so requests can be routed to the owning worker, and take a file lock to elect the one worker that runs scheduled jobs.
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from job_queue import Job
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, where the app runs as a single worker
+    fcntl = None
+
+
+class WorkerState:
+    def __init__(self, db_path, heartbeat_interval=10, stale_after=30):
+        # A worker whose heartbeat is older than stale_after seconds is treated as gone
+        self.db_path = db_path
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.address = None
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS workers (worker_id TEXT PRIMARY KEY, address TEXT, heartbeat REAL NOT NULL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS script_runs ("
+                "run_id TEXT PRIMARY KEY, session_id TEXT NOT NULL, script_name TEXT NOT NULL, "
+                "worker_id TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_script_runs_session ON script_runs (session_id, script_name, created)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_id TEXT PRIMARY KEY, kind TEXT, description TEXT, status TEXT NOT NULL, result TEXT, error TEXT, "
+                "created REAL, started REAL, finished REAL, worker_id TEXT NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def register(self, address):
+        # address is the base URL other workers use to reach this one
+        self.address = address
+        self.heartbeat()
+        threading.Thread(target=self._heartbeat_loop, daemon=True).start()
+
+    def heartbeat(self):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO workers (worker_id, address, heartbeat) VALUES (?, ?, ?)",
+                         (self.worker_id, self.address, time.time()))
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            try:
+                self.heartbeat()
+            except sqlite3.Error as e:
+                print(f"Error recording worker heartbeat: {e}")
+
+    def unregister(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM workers WHERE worker_id = ?", (self.worker_id,))
+
+    def _owner_address(self, conn, worker_id):
+        # Address of another live worker, None for this worker or one that stopped
+        if worker_id == self.worker_id:
+            return None
+        row = conn.execute("SELECT address, heartbeat FROM workers WHERE worker_id = ?", (worker_id,)).fetchone()
+        if row is None or time.time() - row[1] > self.stale_after:
+            return None
+        return row[0]
+
+    def record_run(self, run):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO script_runs (run_id, session_id, script_name, worker_id, created) VALUES (?, ?, ?, ?, ?)",
+                         (run.run_id, run.session_id, run.script_name, self.worker_id, run.created))
+
+    def run_owner(self, session_id, run_id=None, script_name=None):
+        # Address of the worker holding a session's run, by id or as its latest run of script_name
+        with self._connect() as conn:
+            if run_id:
+                row = conn.execute("SELECT worker_id FROM script_runs WHERE run_id = ? AND session_id = ?",
+                                   (run_id, session_id)).fetchone()
+            else:
+                row = conn.execute("SELECT worker_id FROM script_runs WHERE session_id = ? AND script_name = ? ORDER BY created DESC LIMIT 1",
+                                   (session_id, script_name)).fetchone()
+            return self._owner_address(conn, row[0]) if row else None
+
+    def save_job(self, job):
+        # Called by the owning worker's JobQueue on every status change
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, kind, description, status, result, error, created, started, finished, worker_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.kind, job.description, job.status, None if job.result is None else str(job.result),
+                 job.error, job.created, job.started, job.finished, self.worker_id),
+            )
+
+    def job_owner(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT worker_id FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            return self._owner_address(conn, row[0]) if row else None
+
+    def load_job(self, job_id):
+        # Last recorded state of a job whose worker is gone, a job it left unfinished is reported as failed
+        with self._connect() as conn:
+            row = conn.execute("SELECT kind, description, status, result, error, created, started, finished FROM jobs WHERE job_id = ?",
+                               (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = Job(row[0], row[1])
+        job.id = job_id
+        job.status, job.result, job.error, job.created, job.started, job.finished = row[2:]
+        if job.status in ('pending', 'running'):
+            job.status, job.error = 'failed', 'The worker running this job stopped'
+        return job
+
+    def prune(self, max_age=86400):
+        # Drop old runs and jobs and workers that stopped sending heartbeats, run by the leader
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM script_runs WHERE created < ?", (now - max_age,))
+            conn.execute("DELETE FROM jobs WHERE created < ?", (now - max_age,))
+            conn.execute("DELETE FROM workers WHERE heartbeat < ?", (now - max_age,))
+
+
+class LeaderLock:
+    def __init__(self, lock_path):
+        # Whichever worker holds the lock file is the leader, the lock is released when its process exits
+        self.lock_path = lock_path
+        self._lock_file = None
+        self.is_leader = False
+
+    def try_acquire(self):
+        if fcntl is None:
+            self.is_leader = True
+            return True
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        self.is_leader = True
+        return True
+
+    def run_when_elected(self, on_elected, retry_interval=15):
+        # Followers keep trying so a new leader takes over when the current one exits
+        def elect():
+            while not self.try_acquire():
+                time.sleep(retry_interval)
+            on_elected()
+        threading.Thread(target=elect, daemon=True).start()